@@ -0,0 +1,67 @@
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created receiver, runs settings.SQLITE_PRAGMAS
+    on every new sqlite connection (most pragmas are per connection)
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None) or {}
+    for name, value in pragmas.items():
+        if not name.isidentifier():
+            continue
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+# Read replica routing
+# reads marked with the catalog hint (see courses.services.get_catalog_manager)
+# go to settings.DATABASE_REPLICA_ALIAS, everything else, and every read after
+# a write in the same request/task, stays on the primary
+
+
+primary_pinned = ContextVar('primary_pinned', default=False)
+
+
+def pin_primary():
+    primary_pinned.set(True)
+
+
+def is_primary_pinned():
+    return primary_pinned.get()
+
+
+class PrimaryReplicaRouter:
+    def get_replica(self):
+        return getattr(settings, 'DATABASE_REPLICA_ALIAS', None)
+
+    def db_for_read(self, model, **hints):
+        replica = self.get_replica()
+        if replica is None:
+            return None
+        if is_primary_pinned():
+            return DEFAULT_DB_ALIAS
+        if hints.get('catalog'):
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        # explicit, None would fall back to the db a
+        # replica-loaded instance came from
+        pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, self.get_replica()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is a copy of the primary, never migrated directly
+        if db == self.get_replica():
+            return False
+        return None
@@ -0,0 +1,30 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from .db import primary_pinned
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+@sync_and_async_middleware
+def primary_pin_middleware(get_response):
+    """
+    Starts every request unpinned, unsafe methods pinned to the
+    primary from the start, see cfehome.db.PrimaryReplicaRouter
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = primary_pinned.set(request.method not in SAFE_METHODS)
+            try:
+                return await get_response(request)
+            finally:
+                primary_pinned.reset(token)
+        return middleware
+
+    def middleware(request):
+        token = primary_pinned.set(request.method not in SAFE_METHODS)
+        try:
+            return get_response(request)
+        finally:
+            primary_pinned.reset(token)
+    return middleware
@@ -18,7 +18,7 @@ from decouple import config
 
 BASE_URL = config("BASE_URL", default='http://127.0.0.1:8000')
 # default backend
-# EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = config("EMAIL_BACKEND", default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_ADDRESS = config("ADMIN_USER_EMAIL", default=None)
 EMAIL_HOST = config("EMAIL_HOST", cast=str, default=None)
 EMAIL_PORT = config("EMAIL_PORT", cast=str, default='587') # Recommended
@@ -26,6 +26,23 @@ EMAIL_HOST_USER = config("EMAIL_HOST_USER", cast=str, default=None)
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD", cast=str, default=None)
 EMAIL_USE_TLS = config("EMAIL_USE_TLS", cast=bool, default=True)  # Use EMAIL_PORT 587 for TLS
 # EMAIL_USE_SSL = config("EMAIL_USE_SSL", cast=bool, default=False)  # EUse MAIL_PORT 465 for SSL
+# outbound queue, see manage.py run_mail_worker
+EMAILS_QUEUE_MAX_ATTEMPTS = config("EMAILS_QUEUE_MAX_ATTEMPTS", cast=int, default=5)
+EMAILS_QUEUE_RETRY_BACKOFF = config("EMAILS_QUEUE_RETRY_BACKOFF", cast=int, default=30)
+EMAILS_QUEUE_RETRY_BACKOFF_MAX = config("EMAILS_QUEUE_RETRY_BACKOFF_MAX", cast=int, default=60 * 60)
+EMAILS_QUEUE_LEASE = config("EMAILS_QUEUE_LEASE", cast=int, default=5 * 60)
+# manage.py purge_verification_events
+EMAILS_VERIFICATION_RETENTION_DAYS = config("EMAILS_VERIFICATION_RETENTION_DAYS", cast=int, default=30)
+EMAILS_VERIFICATION_EXPIRED_RETENTION_DAYS = config("EMAILS_VERIFICATION_EXPIRED_RETENTION_DAYS", cast=int, default=1)
+# a login request inside this window gets the still valid event back, no new email
+EMAILS_VERIFICATION_REUSE_WINDOW = config("EMAILS_VERIFICATION_REUSE_WINDOW", cast=int, default=5 * 60)
+# token buckets: capacity requests, refilled over period seconds
+EMAILS_RATE_LIMIT_EMAIL_CAPACITY = config("EMAILS_RATE_LIMIT_EMAIL_CAPACITY", cast=int, default=3)
+EMAILS_RATE_LIMIT_EMAIL_PERIOD = config("EMAILS_RATE_LIMIT_EMAIL_PERIOD", cast=int, default=15 * 60)
+EMAILS_RATE_LIMIT_IP_CAPACITY = config("EMAILS_RATE_LIMIT_IP_CAPACITY", cast=int, default=20)
+EMAILS_RATE_LIMIT_IP_PERIOD = config("EMAILS_RATE_LIMIT_IP_PERIOD", cast=int, default=15 * 60)
+EMAILS_TRUST_X_FORWARDED_FOR = config("EMAILS_TRUST_X_FORWARDED_FOR", cast=bool, default=False)
+EMAILS_INACTIVE_CACHE_TIMEOUT = config("EMAILS_INACTIVE_CACHE_TIMEOUT", cast=int, default=60 * 60)
 
 ADMIN_USER_NAME=config("ADMIN_USER_NAME", default="Burim")
 ADMIN_USER_EMAIL=config("ADMIN_USER_EMAIL", default=None)
@@ -80,6 +97,7 @@ INTERNAL_IPS = ["0.0.0.0",
 NPM_BIN_PATH = r"C:\Users\Admin\AppData\Roaming\npm\npm.cmd"
 
 MIDDLEWARE = [
+    'cfehome.middleware.primary_pin_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -109,6 +127,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'courses.context_processors.fragment_cache',
             ],
         },
     },
@@ -120,13 +139,94 @@ WSGI_APPLICATION = 'cfehome.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLITE_PROFILE=production turns on WAL and the pragmas below through
+# cfehome.db.configure_sqlite (a connection_created hook), takes write locks
+# up front and keeps connections open between requests
+SQLITE_PROFILE = config('SQLITE_PROFILE', default='default')
+SQLITE_PRODUCTION = SQLITE_PROFILE == 'production'
+SQLITE_PRODUCTION_PRAGMAS = {
+    # readers don't block the writer and the writer doesn't block readers
+    'journal_mode': 'WAL',
+    # fsync at checkpoints only, still safe with WAL
+    'synchronous': 'NORMAL',
+    'mmap_size': config('SQLITE_MMAP_SIZE', cast=int, default=128 * 1024 * 1024),
+    # negative is KiB
+    'cache_size': config('SQLITE_CACHE_SIZE', cast=int, default=-32000),
+    'temp_store': 'MEMORY',
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', cast=int, default=5000),
+}
+SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS if SQLITE_PRODUCTION else {}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': config('CONN_MAX_AGE', cast=int, default=60 if SQLITE_PRODUCTION else 0),
+        'CONN_HEALTH_CHECKS': config('CONN_HEALTH_CHECKS', cast=bool, default=SQLITE_PRODUCTION),
+        'OPTIONS': {
+            # seconds to wait on a locked database
+            'timeout': SQLITE_PRODUCTION_PRAGMAS['busy_timeout'] / 1000 if SQLITE_PRODUCTION else 5,
+        },
+    }
+}
+if SQLITE_PRODUCTION:
+    # BEGIN IMMEDIATE, a read-then-write transaction can't fail its lock upgrade
+    DATABASES['default']['OPTIONS']['transaction_mode'] = config('SQLITE_TRANSACTION_MODE', default='IMMEDIATE')
+
+# optional read replica for catalog reads, see cfehome.db.PrimaryReplicaRouter
+# locally: copy db.sqlite3 and set DATABASE_REPLICA_NAME to the copy
+DATABASE_REPLICA_NAME = config('DATABASE_REPLICA_NAME', default=None)
+DATABASE_REPLICA_ALIAS = None
+if DATABASE_REPLICA_NAME:
+    DATABASE_REPLICA_ALIAS = 'replica'
+    DATABASES[DATABASE_REPLICA_ALIAS] = {
+        'ENGINE': config('DATABASE_REPLICA_ENGINE', default='django.db.backends.sqlite3'),
+        'NAME': DATABASE_REPLICA_NAME,
+        'USER': config('DATABASE_REPLICA_USER', default=''),
+        'PASSWORD': config('DATABASE_REPLICA_PASSWORD', default=''),
+        'HOST': config('DATABASE_REPLICA_HOST', default=''),
+        'PORT': config('DATABASE_REPLICA_PORT', default=''),
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['cfehome.db.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# locmem is per process, point this at a shared backend (redis, memcached)
+# so version bumps reach every worker
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='cfehome'),
     }
 }
 
+# sessions only hold a few small keys (email_id, next_url, entitlements...)
+# db: a read per request; cached_db: reads from CACHES, writes through to
+# the db, needs a cache shared by all processes (not locmem);
+# cache: cache only; signed_cookies: no server side storage at all
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_BACKEND = config('SESSION_BACKEND', default='db')
+# an alias above or a dotted engine path
+SESSION_ENGINE = SESSION_ENGINES.get(SESSION_BACKEND, SESSION_BACKEND)
+
+COURSES_CATALOG_CACHE_TIMEOUT = config('COURSES_CATALOG_CACHE_TIMEOUT', cast=int, default=60 * 60)
+COURSES_FRAGMENT_CACHE_TIMEOUT = config('COURSES_FRAGMENT_CACHE_TIMEOUT', cast=int, default=60 * 60)
+COURSES_FEED_PAGE_SIZE = config('COURSES_FEED_PAGE_SIZE', cast=int, default=12)
+# seconds session entitlements are trusted before Students is re-read
+COURSES_ENTITLEMENTS_MAX_AGE = config('COURSES_ENTITLEMENTS_MAX_AGE', cast=int, default=60)
+COURSES_API_PAGE_SIZE = config('COURSES_API_PAGE_SIZE', cast=int, default=50)
+# shared/edge caches may serve api responses this long without revalidating
+COURSES_API_CACHE_MAX_AGE = config('COURSES_API_CACHE_MAX_AGE', cast=int, default=60)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -182,3 +282,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CLOUDINARY_CLOUD_NAME = config('CLOUDINARY_CLOUD_NAME', default='')
 CLOUDINARY_PUBLIC_API_KEY = config('CLOUDINARY_PUBLIC_API_KEY', default='')
 CLOUDINARY_SECRET_API_KEY = config('CLOUDINARY_SECRET_API_KEY')
+CLOUDINARY_URL_CACHE_SIZE = config('CLOUDINARY_URL_CACHE_SIZE', cast=int, default=4096)
+CLOUDINARY_EMBED_CACHE_SIZE = config('CLOUDINARY_EMBED_CACHE_SIZE', cast=int, default=1024)
+# private lesson videos, expiring signed urls need a token auth key
+CLOUDINARY_AUTH_TOKEN_KEY = config('CLOUDINARY_AUTH_TOKEN_KEY', default=None)
+CLOUDINARY_SIGNED_URL_TTL = config('CLOUDINARY_SIGNED_URL_TTL', cast=int, default=60 * 60)
+CLOUDINARY_SIGNED_URL_REFRESH_MARGIN = config('CLOUDINARY_SIGNED_URL_REFRESH_MARGIN', cast=int, default=60)
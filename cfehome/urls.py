@@ -29,6 +29,7 @@ urlpatterns = [
     path('hx/login/', email_token_login_view),
     path('verify/<uuid:token>/', verify_email_token_view),
     path('courses/', include('courses.urls')),
+    path('api/courses/', include('courses.api_urls')),
     path('admin/', admin.site.urls),
 ]
 
@@ -2,6 +2,7 @@ from django.shortcuts import render
 from emails.forms import EmailForm
 from django.conf import settings
 from emails import services as emails_services
+from emails.ratelimit import get_client_ip
 from emails.models import Email, EmailVerificationEvent
 
 def login_logout_view(request):
@@ -21,10 +22,12 @@ def home_view(request, *args, **kwargs):
     }
     if form.is_valid():
         email_val = form.cleaned_data.get('email')
-        obj = emails_services.start_verification_event(email_val)
+        obj, queued = emails_services.start_verification_event(email_val, client_ip=get_client_ip(request))
         print(obj)
         context['form'] = EmailForm()
         context['message'] = f'success you have access. message from {EMAIL_ADDRESS}'
+        if obj is None:
+            context['message'] = 'Too many login requests, try again in a few minutes.'
     else:
         print(form.errors)
     print('email_id', request.session.get('email_id'))
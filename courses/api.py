@@ -0,0 +1,135 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+from . import services
+from . import cache as course_cache
+from .views import get_feed_url
+
+API_PAGE_SIZE = getattr(settings, 'COURSES_API_PAGE_SIZE', 50)
+API_CACHE_MAX_AGE = getattr(settings, 'COURSES_API_CACHE_MAX_AGE', 60)
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def get_course_data(row):
+    # public_id is the api id, the pk stays internal
+    path = f"/courses/{row['public_id']}"
+    return {
+        'id': row['public_id'],
+        'title': row['title'],
+        'description': row['description'],
+        'access': row['access'],
+        'url': f"{path}/",
+        'api_url': f"/api{path}/",
+        'thumbnail_url': row['thumbnail_url'],
+        'thumbnail_srcset': row['thumbnail_srcset'],
+        'display_image_url': row['display_image_url'],
+        'display_image_srcset': row['display_image_srcset'],
+        'timestamp': row['timestamp'],
+        'updated': row['updated'],
+    }
+
+
+def get_lesson_data(row, course_id):
+    return {
+        'id': row['public_id'],
+        'title': row['title'],
+        'description': row['description'],
+        'status': row['status'],
+        'can_preview': row['can_preview'],
+        'has_quiz': row['has_quiz'],
+        'order': row['order'],
+        'url': f"/courses/{course_id}/lessons/{row['public_id']}/",
+        'thumbnail_url': row['thumbnail_url'],
+        'thumbnail_srcset': row['thumbnail_srcset'],
+        'updated': row['updated'],
+    }
+
+
+def get_lesson_results(course_row, cursor=None):
+    page = services.get_lesson_values_page(course_row['id'], cursor=cursor, page_size=API_PAGE_SIZE)
+    if page is None:
+        raise InvalidCursor
+    course_id = course_row['public_id']
+    return {
+        'results': [get_lesson_data(row, course_id) for row in page.object_list],
+        'next': get_feed_url(f"/api/courses/{course_id}/lessons/", page.next_cursor),
+    }
+
+
+def render_cached_json(request, cache_key, get_payload):
+    """
+    Compact json body and its etag, built once per catalog
+    version (course and lesson saves bump it) and served
+    from cache after that, 304 when the etag matches.
+    get_payload raises Http404/InvalidCursor, neither is cached
+    """
+    cache_key = course_cache.make_key('courses:api', services.get_catalog_version(), cache_key)
+    cached = cache.get(cache_key)
+    if cached is None:
+        try:
+            payload = get_payload()
+        except InvalidCursor:
+            return JsonResponse({'detail': 'Invalid cursor'}, status=400)
+        body = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+        etag = quote_etag(hashlib.md5(body).hexdigest())
+        cached = (body, etag)
+        cache.set(cache_key, cached, services.CATALOG_CACHE_TIMEOUT)
+    body, etag = cached
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response.headers['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=API_CACHE_MAX_AGE)
+    return response
+
+
+@require_safe
+def course_list_api_view(request):
+    cursor = request.GET.get('cursor')
+
+    def get_payload():
+        page = services.get_course_values_page(cursor=cursor, page_size=API_PAGE_SIZE)
+        if page is None:
+            raise InvalidCursor
+        return {
+            'results': [get_course_data(row) for row in page.object_list],
+            'next': get_feed_url('/api/courses/', page.next_cursor),
+        }
+    return render_cached_json(request, course_cache.make_key('courses', services.get_cursor_key(cursor)), get_payload)
+
+
+@require_safe
+def course_detail_api_view(request, course_id=None):
+    def get_payload():
+        course_row = services.get_course_values(course_id=course_id)
+        if course_row is None:
+            raise Http404
+        data = get_course_data(course_row)
+        data['lessons'] = get_lesson_results(course_row)
+        return data
+    return render_cached_json(request, course_cache.make_key('course', course_cache.hash_part(course_id)), get_payload)
+
+
+@require_safe
+def lesson_list_api_view(request, course_id=None):
+    cursor = request.GET.get('cursor')
+
+    def get_payload():
+        course_row = services.get_course_values(course_id=course_id)
+        if course_row is None:
+            raise Http404
+        return get_lesson_results(course_row, cursor=cursor)
+    return render_cached_json(
+        request,
+        course_cache.make_key('lessons', course_cache.hash_part(course_id), services.get_cursor_key(cursor)),
+        get_payload
+    )
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path('<slug:course_id>/lessons/', api.lesson_list_api_view),
+    path('<slug:course_id>/', api.course_detail_api_view),
+    path('', api.course_list_api_view),
+]
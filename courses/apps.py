@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 import helpers
 
 
@@ -7,4 +8,7 @@ class CoursesConfig(AppConfig):
     name = 'courses'
 
     def ready(self):
-        helpers.cloudinary_init()
\ No newline at end of file
+        helpers.cloudinary_init()
+        from cfehome.db import configure_sqlite
+        connection_created.connect(configure_sqlite, dispatch_uid='cfehome.db.configure_sqlite')
+        from . import signals  # noqa: F401
\ No newline at end of file
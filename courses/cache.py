@@ -0,0 +1,40 @@
+import hashlib
+import uuid
+from django.core.cache import cache
+
+
+# Versioned cache keys
+# every cached entry embeds the current version token of its namespace,
+# bumping the version makes the old entries unreachable in every worker
+# that shares the cache backend, no global flush needed
+
+
+def make_key(*parts):
+    return ":".join(f"{part}" for part in parts)
+
+
+def hash_part(value):
+    # client input in a key: fixed length, no spaces or control
+    # characters, memcached rejects keys that have either
+    return hashlib.md5(f"{value}".encode('utf-8')).hexdigest()
+
+
+def get_version(version_key):
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex[:12], timeout=None)
+        version = cache.get(version_key) or uuid.uuid4().hex[:12]
+    return version
+
+
+def bump_version(*version_keys):
+    # dropping the token is enough, the next reader creates a fresh one
+    cache.delete_many(version_keys)
+
+
+async def aget_version(version_key):
+    version = await cache.aget(version_key)
+    if version is None:
+        await cache.aadd(version_key, uuid.uuid4().hex[:12], timeout=None)
+        version = await cache.aget(version_key) or uuid.uuid4().hex[:12]
+    return version
@@ -0,0 +1,8 @@
+from django.conf import settings
+
+
+def fragment_cache(request):
+    # timeout of the {% cache %} blocks in courses/snippets/list-display.html
+    return {
+        'fragment_cache_timeout': getattr(settings, 'COURSES_FRAGMENT_CACHE_TIMEOUT', 60 * 60),
+    }
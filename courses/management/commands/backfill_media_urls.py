@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from courses.models import Course, Lesson, refresh_media_urls
+from courses import services
+
+
+class Command(BaseCommand):
+    help = 'Compute the precomputed media url columns of courses and lessons'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--missing', action='store_true',
+                            help='only rows with an empty thumbnail_url or thumbnail_srcset')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        for model in (Course, Lesson):
+            qs = model.objects.all()
+            if model is Lesson:
+                # get_thumbnail doesn't read the course, keep the join out
+                qs = qs.defer('course')
+            if options['missing']:
+                qs = qs.filter(
+                    Q(thumbnail_url__isnull=True) | Q(thumbnail_url='') |
+                    Q(thumbnail_srcset__isnull=True) | Q(thumbnail_srcset='')
+                )
+            # updated rolls the card fragment caches keyed on it
+            columns = list(model().get_media_urls().keys()) + ['updated']
+            updated = 0
+            batch = []
+            for obj in qs.order_by('pk').iterator(chunk_size=batch_size):
+                if refresh_media_urls(obj, commit=False):
+                    obj.updated = timezone.now()
+                    batch.append(obj)
+                if len(batch) >= batch_size:
+                    model.objects.bulk_update(batch, columns)
+                    updated += len(batch)
+                    batch = []
+            if batch:
+                model.objects.bulk_update(batch, columns)
+                updated += len(batch)
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {updated} updated')
+        # bulk_update skips the post_save signals
+        services.bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS('Media urls backfilled'))
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from importlib import import_module
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from courses.models import Lesson, PublishStatus, Students
+from courses import services
+from emails.models import Email
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the course views through the ASGI handler with many '
+        'requests in flight, the way uvicorn serves them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='per path and concurrency level')
+        parser.add_argument('--concurrency', default='1,10,50', help='comma separated levels')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='defaults to the catalog, a course and one of its lessons')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        if total < 1:
+            raise CommandError('--requests must be at least 1')
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        student = self.get_student()
+        paths = options['paths'] or self.get_default_paths(student)
+        # anonymous, and with the session verify_email_token_view leaves behind
+        sessions = [('anon', None), ('email', self.get_session(student))]
+        self.stdout.write(
+            f"{'path':<48}{'session':>8}{'in flight':>10}{'req/s':>10}{'p95 ms':>10}{'errors':>8}"
+        )
+        # ALLOWED_HOSTS for the test client's host
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for path in paths:
+                for name, store in sessions:
+                    for level in levels:
+                        rate, p95, errors = asyncio.run(self.run_level(path, level, total, store))
+                        self.stdout.write(
+                            f'{path:<48}{name:>8}{level:>10}{rate:>10.0f}{p95:>10.2f}{errors:>8}'
+                        )
+        for _, store in sessions:
+            if store is not None:
+                store.delete()
+
+    def get_student(self):
+        return Students.objects.filter(
+            course__status=PublishStatus.PUBLISHED,
+            course__lesson__status=PublishStatus.PUBLISHED
+        ).select_related('course').first()
+
+    def get_default_paths(self, student=None):
+        lesson = Lesson.objects.with_course().filter(
+            course__status=PublishStatus.PUBLISHED,
+            status=PublishStatus.PUBLISHED,
+            **({'course': student.course} if student else {})
+        ).order_by('order', 'id').first()
+        if lesson is None:
+            return ['/courses/']
+        return ['/courses/', f'{lesson.course.path}/', f'{lesson.path}/']
+
+    def get_session(self, student=None):
+        email_obj = None
+        if student is not None:
+            email_obj = Email.objects.filter(email=student.email).first()
+        if email_obj is None:
+            email_obj, _ = Email.objects.get_or_create(email='benchmark@example.com')
+        store = import_module(settings.SESSION_ENGINE).SessionStore()
+        store['email_id'] = f"{email_obj.id}"
+        services.store_session_entitlements(store, email_obj)
+        store.save()
+        return store
+
+    async def run_level(self, path, level, total, store=None):
+        client = AsyncClient()
+        if store is not None:
+            client.cookies[settings.SESSION_COOKIE_NAME] = store.session_key
+        await client.get(path)  # warm up caches
+        semaphore = asyncio.Semaphore(level)
+        timings = []
+        errors = 0
+
+        async def fetch():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                timings.append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        return total / elapsed, p95, errors
@@ -0,0 +1,87 @@
+import statistics
+import time
+from importlib import import_module
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from courses.models import Lesson, PublishStatus, Students
+from courses import services
+from emails.models import Email
+
+
+class Command(BaseCommand):
+    help = 'Time the lesson view path under each session engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--engines', default=','.join(settings.SESSION_ENGINES),
+                            help='comma separated SESSION_ENGINES aliases or dotted paths')
+        parser.add_argument('--path', help='lesson url, defaults to the first published lesson with a student')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        if total < 1:
+            raise CommandError('--requests must be at least 1')
+        path, email_obj = self.get_target(options['path'])
+        self.stdout.write(f'{path}, {total} requests per engine')
+        self.stdout.write(f"{'engine':<16}{'mean ms':>10}{'p95 ms':>10}{'queries':>10}{'cookie':>8}")
+        for alias in options['engines'].split(','):
+            alias = alias.strip()
+            engine = settings.SESSION_ENGINES.get(alias, alias)
+            # ALLOWED_HOSTS for the test client's host
+            with override_settings(SESSION_ENGINE=engine, ALLOWED_HOSTS=['*']):
+                self.run_engine(alias, engine, path, email_obj, total)
+
+    def get_target(self, path):
+        if path:
+            student = None
+        else:
+            student = Students.objects.filter(
+                course__status=PublishStatus.PUBLISHED,
+                course__lesson__status=PublishStatus.PUBLISHED
+            ).select_related('course').first()
+            lesson = Lesson.objects.with_course().filter(
+                course__status=PublishStatus.PUBLISHED,
+                status=PublishStatus.PUBLISHED,
+                **({'course': student.course} if student else {})
+            ).order_by('order', 'id').first()
+            if lesson is None:
+                raise CommandError('No published lesson, pass --path')
+            path = f'{lesson.path}/'
+        email_obj = None
+        if student is not None:
+            email_obj = Email.objects.filter(email=student.email).first()
+        return path, email_obj
+
+    def get_session(self, engine, email_obj):
+        store = import_module(engine).SessionStore()
+        if email_obj is not None:
+            # the state verify_email_token_view leaves behind
+            store['email_id'] = f"{email_obj.id}"
+            services.store_session_entitlements(store, email_obj)
+        store.save()
+        return store
+
+    def run_engine(self, alias, engine, path, email_obj, total):
+        client = Client()
+        store = self.get_session(engine, email_obj)
+        cookie = store.session_key
+        client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        client.get(path)  # warm up caches and the middleware chain
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(total):
+                start = time.perf_counter()
+                response = client.get(path)
+                timings.append((time.perf_counter() - start) * 1000)
+        store.delete()
+        if response.status_code != 200:
+            self.stderr.write(f'{alias}: status {response.status_code}')
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'{alias:<16}{statistics.mean(timings):>10.2f}{p95:>10.2f}'
+            f'{len(queries) / total:>10.2f}{len(cookie or ""):>8}'
+        )
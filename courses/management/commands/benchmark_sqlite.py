@@ -0,0 +1,107 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrent readers and writers against a scratch SQLite file, '
+        'with the default settings and with the production profile'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help='share of operations that write (session saves, token checks)')
+        parser.add_argument('--rows', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1:
+            raise CommandError('--threads must be at least 1')
+        profiles = [
+            # django's own sqlite defaults: rollback journal, 5s timeout, BEGIN DEFERRED
+            ('default', {}, 5, ''),
+            ('production', settings.SQLITE_PRODUCTION_PRAGMAS,
+             settings.SQLITE_PRODUCTION_PRAGMAS['busy_timeout'] / 1000, 'IMMEDIATE'),
+        ]
+        self.stdout.write(
+            f"{options['threads']} threads, {options['seconds']}s, "
+            f"{options['write_ratio']:.0%} writes"
+        )
+        self.stdout.write(f"{'profile':<12}{'ops/s':>10}{'p95 ms':>10}{'locked':>8}")
+        for name, pragmas, timeout, begin in profiles:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, 'bench.sqlite3')
+                self.create_db(path, pragmas, options['rows'])
+                self.run_profile(name, path, pragmas, timeout, begin, options)
+
+    def connect(self, path, pragmas, timeout):
+        # autocommit, transactions are issued explicitly like django does
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        for key, value in pragmas.items():
+            conn.execute(f'PRAGMA {key} = {value}')
+        return conn
+
+    def create_db(self, path, pragmas, rows):
+        conn = self.connect(path, pragmas, 5)
+        conn.execute('CREATE TABLE session (key INTEGER PRIMARY KEY, data TEXT, expire REAL)')
+        conn.execute('CREATE TABLE event (id INTEGER PRIMARY KEY, attempts INTEGER, expired INTEGER)')
+        conn.execute('BEGIN')
+        conn.executemany('INSERT INTO session VALUES (?, ?, ?)', ((i, 'x' * 200, time.time()) for i in range(rows)))
+        conn.executemany('INSERT INTO event VALUES (?, 0, 0)', ((i,) for i in range(rows)))
+        conn.execute('COMMIT')
+        conn.close()
+
+    def run_profile(self, name, path, pragmas, timeout, begin, options):
+        deadline = time.monotonic() + options['seconds']
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            conn = self.connect(path, pragmas, timeout)
+            rng = random.Random()
+            latencies = []
+            locked = 0
+            while time.monotonic() < deadline:
+                key = rng.randrange(options['rows'])
+                start = time.perf_counter()
+                try:
+                    if rng.random() < options['write_ratio']:
+                        # read then write in one transaction, the lock upgrade
+                        # that a deferred BEGIN can fail on
+                        conn.execute(f'BEGIN {begin}')
+                        conn.execute('SELECT attempts FROM event WHERE id = ?', (key,)).fetchone()
+                        conn.execute('UPDATE event SET attempts = attempts + 1 WHERE id = ?', (key,))
+                        conn.execute('UPDATE session SET expire = ? WHERE key = ?', (time.time(), key))
+                        conn.execute('COMMIT')
+                    else:
+                        conn.execute('SELECT data FROM session WHERE key = ?', (key,)).fetchone()
+                        conn.execute('SELECT attempts, expired FROM event WHERE id = ?', (key,)).fetchone()
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in f'{e}':
+                        raise
+                    locked += 1
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+            conn.close()
+            with lock:
+                results.append((latencies, locked))
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies = sorted(value for thread_latencies, _ in results for value in thread_latencies)
+        locked = sum(thread_locked for _, thread_locked in results)
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        ops = len(latencies) / options['seconds']
+        self.stdout.write(f'{name:<12}{ops:>10.0f}{p95:>10.2f}{locked:>8}')
@@ -0,0 +1,128 @@
+import csv
+import json
+import sys
+import time
+from django.contrib.auth.base_user import BaseUserManager
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from courses.models import Course, Students
+from courses import services
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSONL roster into courses.Students in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV/JSONL file, '-' reads stdin")
+        parser.add_argument('--course', help='Course public_id or id for rows without a course column')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='defaults to the file extension')
+        parser.add_argument('--email-field', default='email')
+        parser.add_argument('--course-field', default='course')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='parse and validate only, write nothing')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        data_format = options['format']
+        if data_format is None:
+            data_format = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+        self.course_ids = {}
+        default_course_id = None
+        if options['course']:
+            default_course_id = self.get_course_id(options['course'])
+            if default_course_id is None:
+                raise CommandError(f"Course {options['course']} does not exist")
+        dry_run = options['dry_run']
+
+        before = 0 if dry_run else Students.objects.count()
+        stats = {'read': 0, 'valid': 0, 'invalid': 0, 'unknown_course': 0}
+        start = time.monotonic()
+        batch = []
+        handle = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            for row in self.read_rows(handle, data_format):
+                stats['read'] += 1
+                email = self.normalize_email(row.get(options['email_field']))
+                if email is None:
+                    stats['invalid'] += 1
+                    continue
+                course_value = row.get(options['course_field'])
+                course_id = self.get_course_id(course_value) if course_value else default_course_id
+                if course_id is None:
+                    stats['unknown_course'] += 1
+                    continue
+                stats['valid'] += 1
+                batch.append(Students(course_id=course_id, email=email))
+                if len(batch) >= batch_size:
+                    self.write_batch(batch, dry_run)
+                    batch = []
+                    self.report(stats, start)
+            if batch:
+                self.write_batch(batch, dry_run)
+                self.report(stats, start)
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+
+        summary = (
+            f"{stats['read']} rows read, {stats['valid']} valid, "
+            f"{stats['invalid']} invalid emails, {stats['unknown_course']} unknown courses"
+        )
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing written. {summary}'))
+            return
+        created = Students.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'{summary}. {created} students created, {stats["valid"] - created} already enrolled.'
+        ))
+
+    def read_rows(self, handle, data_format):
+        if data_format == 'csv':
+            yield from csv.DictReader(handle)
+            return
+        for line_number, line in enumerate(handle, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise CommandError(f'Invalid JSON on line {line_number}')
+            if isinstance(row, str):
+                row = {'email': row}
+            yield row
+
+    def normalize_email(self, value):
+        if not value:
+            return None
+        email = BaseUserManager.normalize_email(f"{value}".strip())
+        try:
+            validate_email(email)
+        except ValidationError:
+            return None
+        return email
+
+    def get_course_id(self, value):
+        value = f"{value}".strip()
+        if value not in self.course_ids:
+            lookup = {'public_id': value}
+            if value.isdigit():
+                lookup = {'id': int(value)}
+            self.course_ids[value] = Course.objects.filter(**lookup).values_list('id', flat=True).first()
+        return self.course_ids[value]
+
+    def write_batch(self, batch, dry_run):
+        if dry_run:
+            return
+        Students.objects.bulk_create(batch, ignore_conflicts=True)
+        # bulk_create skips the Students signals
+        services.bump_entitlements_version(*{obj.email for obj in batch})
+
+    def report(self, stats, start):
+        elapsed = time.monotonic() - start
+        rate = stats['read'] / elapsed if elapsed > 0 else 0
+        self.stdout.write(f"{stats['read']} rows read, {stats['valid']} queued ({rate:.0f} rows/s)")
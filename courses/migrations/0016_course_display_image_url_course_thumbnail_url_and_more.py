@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0015_alter_quiz_options_alter_students_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='display_image_url',
+            field=models.URLField(blank=True, db_index=True, editable=False, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='thumbnail_url',
+            field=models.URLField(blank=True, db_index=True, editable=False, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='thumbnail_url',
+            field=models.URLField(blank=True, db_index=True, editable=False, max_length=500, null=True),
+        ),
+    ]
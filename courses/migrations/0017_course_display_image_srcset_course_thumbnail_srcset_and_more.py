@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0016_course_display_image_url_course_thumbnail_url_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='display_image_srcset',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='thumbnail_srcset',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='thumbnail_srcset',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0017_course_display_image_srcset_course_thumbnail_srcset_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['timestamp', 'id'], name='courses_cou_timesta_ddbc39_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['course', 'order', 'id'], name='courses_les_course__319038_idx'),
+        ),
+    ]
@@ -1,15 +1,24 @@
-from django.db import models
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
 import uuid
 from cloudinary.models import CloudinaryField
 import helpers
 from django.utils.text import slugify
 from django.utils import timezone
+from . import cache as course_cache
 
 helpers.cloudinary_init()
 
 # Create your models here.
 
 
+# srcset candidates around the rendered 382px card and 750px detail image
+THUMBNAIL_SRCSET_WIDTHS = (320, 382, 480, 640, 764)
+DISPLAY_IMAGE_SRCSET_WIDTHS = (375, 480, 750, 960, 1200, 1500)
+
+
 class AccessRequirement(models.TextChoices):
     ANYONE = 'any', 'Anyone'
     EMAIL_REQUIRED = 'email_required', 'Email Required'
@@ -69,6 +78,26 @@ def get_display_name(instance, *args, **kwargs):
     return f"{model_name} Upload"
 
 
+def refresh_media_urls(instance, commit=True):
+    """
+    Recompute the denormalized media url columns of a Course/Lesson,
+    returns the changed {column: url} (written with an UPDATE when commit)
+    """
+    for field in instance._meta.concrete_fields:
+        if isinstance(field, CloudinaryField):
+            # values assigned as strings are only parsed when loaded from the db
+            setattr(instance, field.attname, field.to_python(getattr(instance, field.attname)))
+    changed = {}
+    for column, url in instance.get_media_urls().items():
+        url = url or None
+        if getattr(instance, column) != url:
+            setattr(instance, column, url)
+            changed[column] = url
+    if commit and changed and instance.pk:
+        instance.__class__.objects.filter(pk=instance.pk).update(**changed)
+    return changed
+
+
 class Course(models.Model):
     title = models.CharField(max_length=120, blank=True)
     description = models.TextField(blank=True, null=True)
@@ -79,6 +108,11 @@ class Course(models.Model):
                             public_id_prefix=get_public_id_prefix,
                             display_name=get_display_name,
                             tags=["course", "thumbnail"])
+    # precomputed from image at save time, see refresh_media_urls
+    thumbnail_url = models.URLField(max_length=500, blank=True, null=True, db_index=True, editable=False)
+    display_image_url = models.URLField(max_length=500, blank=True, null=True, db_index=True, editable=False)
+    thumbnail_srcset = models.TextField(blank=True, null=True, editable=False)
+    display_image_srcset = models.TextField(blank=True, null=True, editable=False)
     access = models.CharField(
         max_length=15,
         choices=AccessRequirement.choices,
@@ -92,6 +126,12 @@ class Course(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # keyset pagination of the catalog feed
+            models.Index(fields=['timestamp', 'id']),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -99,8 +139,11 @@ class Course(models.Model):
         #before save
         if self.public_id == "" or self.public_id is None:
             self.public_id = generate_public_id(self)
-        super().save(*args, **kwargs)
-        #after save
+        # atomic so post_save's on_commit hooks see the media urls
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            #after save
+            refresh_media_urls(self)
 
     def get_absolute_url(self):
         return self.path
@@ -130,12 +173,60 @@ class Course(models.Model):
             field_name='image',
             width=750)
 
+    def get_thumbnail_srcset(self):
+        if not self.image:
+            return None
+        return helpers.get_cloudinary_image_object(
+            self,
+            field_name='image',
+            as_srcset=True,
+            srcset_widths=THUMBNAIL_SRCSET_WIDTHS)
+
+    def get_display_image_srcset(self):
+        if not self.image:
+            return None
+        return helpers.get_cloudinary_image_object(
+            self,
+            field_name='image',
+            as_srcset=True,
+            srcset_widths=DISPLAY_IMAGE_SRCSET_WIDTHS)
+
+    def get_media_urls(self):
+        return {
+            'thumbnail_url': self.get_thumbnail(),
+            'display_image_url': self.get_display_image(),
+            'thumbnail_srcset': self.get_thumbnail_srcset(),
+            'display_image_srcset': self.get_display_image_srcset(),
+        }
+
     # this sets is_published as a class variable
     @property
     def is_published(self):
         return self.status == PublishStatus.PUBLISHED
 
 
+class LessonQuerySet(models.QuerySet):
+    def with_course(self):
+        return self.select_related('course')
+
+    def for_listing(self):
+        # only what courses/snippets/list-display.html reads
+        return self.with_course().only(
+            'id',
+            'title',
+            'public_id',
+            'status',
+            'thumbnail_url',
+            'thumbnail_srcset',
+            'order',
+            'updated',
+            'course__id',
+            'course__title',
+            'course__public_id',
+            'course__access',
+        )
+
+
 class Lesson(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     title = models.CharField(max_length=120)
@@ -154,6 +245,9 @@ class Lesson(models.Model):
                             null=True,
                             type='private',
                             resource_type='video')
+    # thumbnail, or the video poster, precomputed at save time
+    thumbnail_url = models.URLField(max_length=500, blank=True, null=True, db_index=True, editable=False)
+    thumbnail_srcset = models.TextField(blank=True, null=True, editable=False)
     order = models.IntegerField(default=0)
     can_preview = models.BooleanField(default=False, help_text='If user is allowed to see this')
     status = models.CharField(
@@ -164,8 +258,15 @@ class Lesson(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     has_quiz = models.BooleanField(default=False, help_text='If this lesson has a quiz')
+
+    objects = LessonQuerySet.as_manager()
+
     class Meta:
         ordering = ['order', '-updated']
+        indexes = [
+            # keyset pagination of a course's lesson feed
+            models.Index(fields=['course', 'order', 'id']),
+        ]
 
     def __str__(self):
         return self.title
@@ -174,8 +275,11 @@ class Lesson(models.Model):
         #before save
         if self.public_id == "" or self.public_id is None:
             self.public_id = generate_public_id(self)
-        super().save(*args, **kwargs)
-        #after save
+        # atomic so post_save's on_commit hooks see the media urls
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            #after save
+            refresh_media_urls(self)
 
     @property
     def path(self):
@@ -221,6 +325,27 @@ class Lesson(models.Model):
         else:
             return None
 
+    def get_thumbnail_srcset(self):
+        field_name = None
+        if self.thumbnail:
+            field_name = 'thumbnail'
+        elif self.video:
+            field_name = 'video'
+        if field_name is None:
+            return None
+        return helpers.get_cloudinary_image_object(
+            self,
+            field_name=field_name,
+            format='jpg',
+            as_srcset=True,
+            srcset_widths=THUMBNAIL_SRCSET_WIDTHS)
+
+    def get_media_urls(self):
+        return {
+            'thumbnail_url': self.get_thumbnail(),
+            'thumbnail_srcset': self.get_thumbnail_srcset(),
+        }
+
 
 class Students(models.Model):
     course = models.ForeignKey(Course, null=False, on_delete=models.CASCADE)
@@ -234,6 +359,36 @@ class Students(models.Model):
         return self.email
 
 
+QUIZ_CACHE_TIMEOUT = getattr(settings, 'COURSES_QUIZ_CACHE_TIMEOUT', 60 * 60)
+
+QuizAnswer = namedtuple('QuizAnswer', ['public_id', 'text'])
+QuizQuestion = namedtuple('QuizQuestion', ['public_id', 'text', 'answers'])
+
+
+class QuizPayload(namedtuple('QuizPayload', ['public_id', 'title', 'questions'])):
+    """
+    Immutable question/answer tree of a quiz, safe to cache and share,
+    it never carries is_correct
+    """
+    __slots__ = ()
+
+    def as_dict(self):
+        return {
+            'id': self.public_id,
+            'title': self.title,
+            'questions': [
+                {
+                    'id': question.public_id,
+                    'text': question.text,
+                    'answers': [
+                        {'id': answer.public_id, 'text': answer.text}
+                        for answer in question.answers
+                    ]
+                } for question in self.questions
+            ]
+        }
+
+
 class Quiz(models.Model):
     lesson = models.OneToOneField('Lesson', on_delete=models.CASCADE, related_name='quiz')
     title = models.CharField(max_length=120)
@@ -262,6 +417,43 @@ class Quiz(models.Model):
     def get_display_name(self):
         return f"{self.title} - {self.lesson.get_display_name()}"
 
+    @staticmethod
+    def get_cache_version_key(quiz_id):
+        return course_cache.make_key('courses:quiz', quiz_id, 'version')
+
+    def get_cache_version(self):
+        # bumped whenever the quiz, its questions or answers change
+        return course_cache.get_version(self.get_cache_version_key(self.id))
+
+    def get_payload(self):
+        cache_key = course_cache.make_key('courses:quiz', self.id, 'payload', self.get_cache_version())
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return payload
+        answers = models.Prefetch(
+            'answers',
+            queryset=Answer.objects.order_by('id').only('id', 'question_id', 'public_id', 'text')
+        )
+        questions = self.questions.order_by('order', 'id').only(
+            'id', 'quiz_id', 'public_id', 'text'
+        ).prefetch_related(answers)
+        payload = QuizPayload(
+            public_id=self.public_id,
+            title=self.title,
+            questions=tuple(
+                QuizQuestion(
+                    public_id=question.public_id,
+                    text=question.text,
+                    answers=tuple(
+                        QuizAnswer(public_id=answer.public_id, text=answer.text)
+                        for answer in question.answers.all()
+                    )
+                ) for question in questions
+            )
+        )
+        cache.set(cache_key, payload, QUIZ_CACHE_TIMEOUT)
+        return payload
+
 class Question(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions')
     text = models.CharField(max_length=500)
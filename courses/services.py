@@ -1,46 +1,586 @@
-from .models import Course, Lesson, PublishStatus
-from django.db.models import Q
+import base64
+import hashlib
+import json
+from collections import namedtuple
+from datetime import datetime
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from .models import Course, Lesson, PublishStatus, Question, Students, QUIZ_CACHE_TIMEOUT
+from django.db.models import Q, Exists, OuterRef, Subquery, Value, BooleanField, Max, Count
+from django.db import DEFAULT_DB_ALIAS
+from emails.models import Email
+from . import cache as course_cache
+
+CATALOG_VERSION_KEY = 'courses:catalog:version'
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'COURSES_CATALOG_CACHE_TIMEOUT', 60 * 60)
+QUIZ_FIELD_PREFIX = 'question_'
+ENTITLEMENTS_SESSION_KEY = 'entitlements'
+ENTITLEMENTS_SALT = 'courses.entitlements'
+# bound on how stale they get when a version bump is missed,
+# e.g. a per-process cache that another worker bumped
+ENTITLEMENTS_MAX_AGE = getattr(settings, 'COURSES_ENTITLEMENTS_MAX_AGE', 60)
+FEED_PAGE_SIZE = getattr(settings, 'COURSES_FEED_PAGE_SIZE', 12)
+CATALOG_ROW_FIELDS = ('id', 'title', 'public_id', 'thumbnail_url', 'thumbnail_srcset', 'updated', 'timestamp')
+COURSE_VALUES_FIELDS = (
+    'id', 'public_id', 'title', 'description', 'access',
+    'thumbnail_url', 'thumbnail_srcset', 'display_image_url', 'display_image_srcset',
+    'timestamp', 'updated',
+)
+LESSON_VALUES_FIELDS = (
+    'id', 'public_id', 'title', 'description', 'status', 'can_preview', 'has_quiz',
+    'order', 'thumbnail_url', 'thumbnail_srcset', 'updated',
+)
+
+LessonAccess = namedtuple('LessonAccess', ['lesson', 'course', 'quiz', 'is_enrolled'])
+QuizResult = namedtuple('QuizResult', ['score', 'total_questions', 'percentage'])
+FeedPage = namedtuple('FeedPage', ['object_list', 'next_cursor'])
+
+
+class CatalogRow(namedtuple('CatalogRow', ['id', 'title', 'path', 'thumbnail_url', 'thumbnail_srcset', 'updated'])):
+    """
+    Render-ready course card, quacks like a Course
+    for courses/snippets/list-display.html
+    """
+    __slots__ = ()
+    is_coming_soon = False
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_absolute_url(self):
+        return self.path
+
+    def get_thumbnail(self):
+        return self.thumbnail_url
+
+
+def get_catalog_manager(model):
+    """
+    Reads cfehome.db.PrimaryReplicaRouter may send to the replica.
+    Cache fills read the primary instead: a lagging replica read
+    right after a version bump would stay cached until the next one
+    """
+    return model.objects.db_manager(hints={'catalog': True})
+
 
 def get_publish_courses():
-    return Course.objects.all()
+    return get_catalog_manager(Course).all()
 
 
-def get_course_detail(course_id=None):
-    if course_id is None:
-        return None
-    obj = None
+def get_catalog_version():
+    return course_cache.get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    course_cache.bump_version(CATALOG_VERSION_KEY)
+
+
+def get_catalog_row(obj):
+    return CatalogRow(
+        id=obj.id,
+        title=obj.title,
+        path=obj.path,
+        thumbnail_url=obj.thumbnail_url,
+        thumbnail_srcset=obj.thumbnail_srcset,
+        updated=obj.updated
+    )
+
+
+# Keyset pagination
+# a cursor is the sort key of the last row of the previous page,
+# the next page is WHERE (key) > (cursor) ORDER BY key LIMIT n
+# so its cost doesn't grow with the table like OFFSET does
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    # ValueError for anything that isn't a cursor we handed out
+    padded = cursor + '=' * (-len(cursor) % 4)
     try:
-        obj = Course.objects.get(
-            status=PublishStatus.PUBLISHED,
-            public_id=course_id
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def get_cursor_key(cursor):
+    # cursors are client input, keep cache keys short and safe
+    if not cursor:
+        return 'first'
+    return course_cache.hash_part(cursor)
+
+
+def get_catalog_cursor_filter(cursor):
+    # rows after a (timestamp, id) cursor, ValueError for a malformed one
+    timestamp, last_id = decode_cursor(cursor)
+    try:
+        timestamp = datetime.fromisoformat(timestamp)
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    return Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=last_id)
+
+
+def get_lesson_cursor_filter(cursor):
+    # rows after an (order, id) cursor, ValueError for a malformed one
+    order, last_id = decode_cursor(cursor)
+    try:
+        order = int(order)
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    return Q(order__gt=order) | Q(order=order, id__gt=last_id)
+
+
+def get_catalog_page_queryset(cursor=None):
+    # None for a malformed cursor
+    qs = get_publish_courses().using(DEFAULT_DB_ALIAS).only(*CATALOG_ROW_FIELDS).order_by('timestamp', 'id')
+    if cursor:
+        try:
+            qs = qs.filter(get_catalog_cursor_filter(cursor))
+        except ValueError:
+            return None
+    return qs
+
+
+def get_catalog_feed_page(objects, page_size):
+    # objects holds up to page_size + 1 rows, the extra one means there's more
+    next_cursor = None
+    if len(objects) > page_size:
+        objects = objects[:page_size]
+        last = objects[-1]
+        next_cursor = encode_cursor(last.timestamp.isoformat(), last.id)
+    return FeedPage(
+        object_list=tuple(get_catalog_row(obj) for obj in objects),
+        next_cursor=next_cursor
+    )
+
+
+def get_grid_cache_key(objects):
+    """
+    Vary-on value for a cached card grid of materialized rows:
+    count, Max(updated) and a hash of the ids
+    """
+    objects = list(objects)
+    last_updated = max((obj.updated for obj in objects), default=None)
+    last_updated = last_updated.timestamp() if last_updated else 0
+    ids = hashlib.md5(",".join(f"{obj.pk}" for obj in objects).encode('utf-8')).hexdigest()
+    return f"{len(objects)}-{last_updated}-{ids}"
+
+
+def get_course_detail_queryset(with_lesson_stats=False):
+    qs = get_catalog_manager(Course).all()
+    if with_lesson_stats:
+        listed = Q(lesson__status__in=[PublishStatus.PUBLISHED, PublishStatus.COMING_SOON])
+        qs = qs.annotate(
+            lessons_count=Count('lesson', filter=listed),
+            lessons_updated=Max('lesson__updated', filter=listed)
         )
-    except:
-        pass
-    return obj
+    return qs
 
 
 def get_course_lessons(course_obj=None):
     lessons = Lesson.objects.none()
     if not isinstance(course_obj, Course):
         return lessons
-    lessons = course_obj.lesson_set.filter(
+    lessons = get_catalog_manager(Lesson).for_listing().filter(
+        course=course_obj,
         course__status=PublishStatus.PUBLISHED,
         status__in=[PublishStatus.PUBLISHED, PublishStatus.COMING_SOON]
     )
     return lessons
 
 
-def get_lesson_detail(course_id=None, lesson_id=None):
+def get_lesson_page_queryset(course_obj=None, cursor=None):
+    # None for a malformed cursor
+    qs = get_course_lessons(course_obj).order_by('order', 'id')
+    if cursor:
+        try:
+            qs = qs.filter(get_lesson_cursor_filter(cursor))
+        except ValueError:
+            return None
+    return qs
+
+
+def get_lesson_feed_page(objects, page_size):
+    next_cursor = None
+    if len(objects) > page_size:
+        objects = objects[:page_size]
+        last = objects[-1]
+        next_cursor = encode_cursor(last.order, last.id)
+    return FeedPage(object_list=objects, next_cursor=next_cursor)
+
+
+def get_course_values_page(cursor=None, page_size=None):
+    """
+    FeedPage of published course dicts, straight from .values()
+    with no model instances, ordered by (timestamp, id),
+    None for a malformed cursor
+    """
+    page_size = page_size or FEED_PAGE_SIZE
+    # fills the api cache, see get_catalog_manager
+    qs = get_publish_courses().using(DEFAULT_DB_ALIAS).filter(
+        status=PublishStatus.PUBLISHED
+    ).order_by('timestamp', 'id').values(*COURSE_VALUES_FIELDS)
+    if cursor:
+        try:
+            qs = qs.filter(get_catalog_cursor_filter(cursor))
+        except ValueError:
+            return None
+    rows = list(qs[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['timestamp'].isoformat(), last['id'])
+    return FeedPage(object_list=rows, next_cursor=next_cursor)
+
+
+def get_course_values(course_id=None):
+    if course_id is None:
+        return None
+    return Course.objects.filter(
+        status=PublishStatus.PUBLISHED,
+        public_id=course_id
+    ).values(*COURSE_VALUES_FIELDS).first()
+
+
+def get_lesson_values_page(course_pk=None, cursor=None, page_size=None):
+    """
+    FeedPage of published/coming soon lesson dicts of a course
+    ordered by (order, id), None for a malformed cursor
+    """
+    page_size = page_size or FEED_PAGE_SIZE
+    qs = Lesson.objects.filter(
+        course_id=course_pk,
+        course__status=PublishStatus.PUBLISHED,
+        status__in=[PublishStatus.PUBLISHED, PublishStatus.COMING_SOON]
+    ).order_by('order', 'id').values(*LESSON_VALUES_FIELDS)
+    if cursor:
+        try:
+            qs = qs.filter(get_lesson_cursor_filter(cursor))
+        except ValueError:
+            return None
+    rows = list(qs[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['order'], last['id'])
+    return FeedPage(object_list=rows, next_cursor=next_cursor)
+
+
+def get_entitlements_version_key(email):
+    email_hash = hashlib.md5(f"{email}".encode('utf-8')).hexdigest()
+    return course_cache.make_key('courses:entitlements', email_hash, 'version')
+
+
+def bump_entitlements_version(*emails):
+    course_cache.bump_version(*[get_entitlements_version_key(email) for email in emails])
+
+
+def store_session_entitlements(session, email_obj):
+    """
+    Signed set of course ids the verified email is enrolled in,
+    saved in the session so lesson views skip the Students lookup
+    """
+    # read the version first, a concurrent Students change then leaves it stale
+    version = course_cache.get_version(get_entitlements_version_key(email_obj.email))
+    course_ids = sorted(set(
+        Students.objects.filter(email=email_obj.email).values_list('course_id', flat=True)
+    ))
+    session[ENTITLEMENTS_SESSION_KEY] = dump_entitlements(email_obj, course_ids, version)
+    return frozenset(course_ids)
+
+
+def dump_entitlements(email_obj, course_ids, version):
+    return signing.dumps({
+        'email_id': email_obj.id,
+        'email': email_obj.email,
+        'courses': course_ids,
+        'version': version,
+    }, salt=ENTITLEMENTS_SALT)
+
+
+def load_entitlements(value, email_id=None):
+    """
+    (data, expired) of the signed session value for email_id,
+    expired once it's older than ENTITLEMENTS_MAX_AGE,
+    (None, False) when there's none
+    """
+    if not value or email_id is None:
+        return None, False
+    expired = False
+    try:
+        data = signing.loads(value, salt=ENTITLEMENTS_SALT, max_age=ENTITLEMENTS_MAX_AGE)
+    except signing.SignatureExpired:
+        expired = True
+        data = signing.loads(value, salt=ENTITLEMENTS_SALT)
+    except signing.BadSignature:
+        return None, False
+    if f"{data.get('email_id')}" != f"{email_id}":
+        return None, False
+    return data, expired
+
+
+def get_session_entitlements(session, email_id=None):
+    """
+    frozenset of enrolled course ids, None when the session has none
+    (callers fall back to get_lesson_access's Students subquery)
+    """
+    data, expired = load_entitlements(session.get(ENTITLEMENTS_SESSION_KEY), email_id)
+    if data is None:
+        return None
+    email_obj = Email(id=data['email_id'], email=data.get('email'))
+    if expired:
+        # this check uses the Students subquery, later ones the re-read set
+        store_session_entitlements(session, email_obj)
+        return None
+    version = course_cache.get_version(get_entitlements_version_key(email_obj.email))
+    if data.get('version') != version:
+        # enrollment changed since it was stored
+        return store_session_entitlements(session, email_obj)
+    return frozenset(data.get('courses') or [])
+
+
+def clear_session_entitlements(session):
+    try:
+        del session[ENTITLEMENTS_SESSION_KEY]
+    except KeyError:
+        pass
+
+
+def get_lesson_access(course_id=None, lesson_id=None, email_id=None, entitlements=None):
+    """
+    lesson, course, quiz and enrollment of the session email
+    in a single query, or none for enrollment when the session
+    already carries its entitlements
+    """
     if lesson_id is None and course_id is None:
         return None
-    obj = None
+    qs = get_lesson_access_queryset(get_email_id(email_id), entitlements)
     try:
-        obj = Lesson.objects.get(
-            course__public_id=course_id,
-            course__status=PublishStatus.PUBLISHED,
-            status__in=[PublishStatus.PUBLISHED, PublishStatus.COMING_SOON],
-            public_id=lesson_id
+        obj = qs.get(**get_lesson_access_lookup(course_id, lesson_id))
+    except Lesson.DoesNotExist:
+        return None
+    return get_lesson_access_result(obj, entitlements)
+
+
+def get_lesson_access_queryset(email_id=None, entitlements=None):
+    # catalog reads unless enrollment comes from Students,
+    # which stays on the primary
+    if email_id is not None and entitlements is None:
+        return Lesson.objects.select_related('course', 'quiz').annotate(
+            is_enrolled=Exists(get_enrollment_queryset(email_id).filter(course=OuterRef('course')))
         )
-    except:
-        pass
-    return obj
+    qs = get_catalog_manager(Lesson).select_related('course', 'quiz')
+    if email_id is None:
+        return qs.annotate(is_enrolled=Value(False, output_field=BooleanField()))
+    return qs
+
+
+def get_email_id(email_id):
+    try:
+        return int(email_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_enrollment_queryset(email_id):
+    email_address = Email.objects.filter(id=email_id).values('email')[:1]
+    return Students.objects.filter(email=Subquery(email_address))
+
+
+def get_lesson_access_lookup(course_id, lesson_id):
+    return {
+        'course__public_id': course_id,
+        'course__status': PublishStatus.PUBLISHED,
+        'status__in': [PublishStatus.PUBLISHED, PublishStatus.COMING_SOON],
+        'public_id': lesson_id,
+    }
+
+
+def get_lesson_access_result(obj, entitlements=None):
+    if not hasattr(obj, 'is_enrolled'):
+        # not annotated, the session's entitlements decide
+        obj.is_enrolled = obj.course_id in entitlements
+    quiz = None
+    if obj.has_quiz:
+        # select_related caches a missing reverse one-to-one as None
+        quiz = getattr(obj, 'quiz', None)
+    return LessonAccess(
+        lesson=obj,
+        course=obj.course,
+        quiz=quiz,
+        is_enrolled=obj.is_enrolled
+    )
+
+def get_quiz_answer_key(quiz):
+    """
+    {question public_id: (answer public_ids, correct answer public_ids)}
+    one query on a cold cache, none on a warm one
+    """
+    cache_key = course_cache.make_key('courses:quiz', quiz.id, 'answer-key', quiz.get_cache_version())
+    answer_key = cache.get(cache_key)
+    if answer_key is not None:
+        return answer_key
+    answers = {}
+    correct = {}
+    rows = Question.objects.filter(quiz_id=quiz.id).values_list(
+        'public_id',
+        'answers__public_id',
+        'answers__is_correct'
+    )
+    for question_id, answer_id, is_correct in rows:
+        answers.setdefault(question_id, set())
+        correct.setdefault(question_id, set())
+        if answer_id is None:
+            # question without answers, still counts towards the total
+            continue
+        answers[question_id].add(answer_id)
+        if is_correct:
+            correct[question_id].add(answer_id)
+    answer_key = {
+        question_id: (frozenset(answer_ids), frozenset(correct[question_id]))
+        for question_id, answer_ids in answers.items()
+    }
+    cache.set(cache_key, answer_key, QUIZ_CACHE_TIMEOUT)
+    return answer_key
+
+
+def get_quiz_submission(data):
+    # question_<question public_id>=<answer public_id> form fields
+    return {
+        key[len(QUIZ_FIELD_PREFIX):]: value
+        for key, value in data.items()
+        if key.startswith(QUIZ_FIELD_PREFIX)
+    }
+
+
+def grade_quiz(quiz, submitted):
+    answer_key = get_quiz_answer_key(quiz)
+    score = 0
+    for question_id, (answer_ids, correct_ids) in answer_key.items():
+        selected_answer_id = submitted.get(question_id)
+        if selected_answer_id not in answer_ids:
+            # unanswered, or an answer from a different question
+            continue
+        if selected_answer_id in correct_ids:
+            score += 1
+    total_questions = len(answer_key)
+    percentage = (score / total_questions) * 100 if total_questions > 0 else 0
+    return QuizResult(score=score, total_questions=total_questions, percentage=percentage)
+
+
+# Async services
+# lookups for the async views on Django's async orm, querysets
+# are materialized here so templates never hit the db.
+# quiz_view is still sync and uses get_lesson_access
+
+
+async def aget_catalog_page(cursor=None, page_size=None):
+    """
+    FeedPage of CatalogRow ordered by (timestamp, id),
+    None for a malformed cursor
+    """
+    page_size = page_size or FEED_PAGE_SIZE
+    # validated before it goes near the cache
+    qs = get_catalog_page_queryset(cursor)
+    if qs is None:
+        return None
+    version = await course_cache.aget_version(CATALOG_VERSION_KEY)
+    cache_key = course_cache.make_key('courses:catalog', version, 'page', get_cursor_key(cursor), page_size)
+    page = await cache.aget(cache_key)
+    if page is not None:
+        return page
+    page = get_catalog_feed_page([obj async for obj in qs[:page_size + 1]], page_size)
+    await cache.aset(cache_key, page, CATALOG_CACHE_TIMEOUT)
+    return page
+
+
+async def aget_catalog_stats():
+    """
+    {'total', 'last_updated'} of the catalog, cached per catalog version
+    """
+    version = await course_cache.aget_version(CATALOG_VERSION_KEY)
+    cache_key = course_cache.make_key('courses:catalog', version, 'stats')
+    stats = await cache.aget(cache_key)
+    if stats is None:
+        stats = await get_publish_courses().using(DEFAULT_DB_ALIAS).order_by().aaggregate(
+            total=Count('id'),
+            last_updated=Max('updated')
+        )
+        await cache.aset(cache_key, stats, CATALOG_CACHE_TIMEOUT)
+    return stats
+
+
+async def aget_course_detail(course_id=None, with_lesson_stats=False):
+    """
+    with_lesson_stats annotates lessons_count and lessons_updated
+    (Max(updated)) of the listed lessons in the same query
+    """
+    if course_id is None:
+        return None
+    try:
+        return await get_course_detail_queryset(with_lesson_stats).aget(
+            status=PublishStatus.PUBLISHED,
+            public_id=course_id
+        )
+    except (Course.DoesNotExist, Course.MultipleObjectsReturned):
+        return None
+
+
+async def aget_lesson_page(course_obj=None, cursor=None, page_size=None):
+    """
+    FeedPage of published/coming soon lessons ordered by (order, id),
+    None for a malformed cursor
+    """
+    page_size = page_size or FEED_PAGE_SIZE
+    qs = get_lesson_page_queryset(course_obj, cursor)
+    if qs is None:
+        return None
+    return get_lesson_feed_page([obj async for obj in qs[:page_size + 1]], page_size)
+
+
+async def astore_session_entitlements(session, email_obj):
+    version = await course_cache.aget_version(get_entitlements_version_key(email_obj.email))
+    course_ids = sorted({
+        course_id async for course_id in
+        Students.objects.filter(email=email_obj.email).values_list('course_id', flat=True)
+    })
+    await session.aset(ENTITLEMENTS_SESSION_KEY, dump_entitlements(email_obj, course_ids, version))
+    return frozenset(course_ids)
+
+
+async def aget_session_entitlements(session, email_id=None):
+    data, expired = load_entitlements(await session.aget(ENTITLEMENTS_SESSION_KEY), email_id)
+    if data is None:
+        return None
+    email_obj = Email(id=data['email_id'], email=data.get('email'))
+    if expired:
+        await astore_session_entitlements(session, email_obj)
+        return None
+    version = await course_cache.aget_version(get_entitlements_version_key(email_obj.email))
+    if data.get('version') != version:
+        return await astore_session_entitlements(session, email_obj)
+    return frozenset(data.get('courses') or [])
+
+
+async def aget_lesson_access(course_id=None, lesson_id=None, email_id=None, entitlements=None):
+    # get_lesson_access's single query on the async orm
+    if lesson_id is None and course_id is None:
+        return None
+    qs = get_lesson_access_queryset(get_email_id(email_id), entitlements)
+    try:
+        obj = await qs.aget(**get_lesson_access_lookup(course_id, lesson_id))
+    except Lesson.DoesNotExist:
+        return None
+    return get_lesson_access_result(obj, entitlements)
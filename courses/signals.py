@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Course, Lesson, Quiz, Question, Answer, Students
+from . import services
+from . import cache as course_cache
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def catalog_changed(sender, instance, **kwargs):
+    # bump after commit so readers can't re-cache the old rows
+    transaction.on_commit(services.bump_catalog_version)
+
+
+def bump_quiz_version(quiz_id):
+    if quiz_id is None:
+        return
+    version_key = Quiz.get_cache_version_key(quiz_id)
+    transaction.on_commit(lambda: course_cache.bump_version(version_key))
+
+
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Quiz)
+def quiz_changed(sender, instance, **kwargs):
+    bump_quiz_version(instance.id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    bump_quiz_version(instance.quiz_id)
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def answer_changed(sender, instance, **kwargs):
+    quiz_id = Question.objects.filter(
+        id=instance.question_id
+    ).values_list('quiz_id', flat=True).first()
+    bump_quiz_version(quiz_id)
+
+
+@receiver(pre_save, sender=Students)
+def students_email_changing(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    old_email = Students.objects.filter(pk=instance.pk).values_list('email', flat=True).first()
+    if old_email and old_email != instance.email:
+        transaction.on_commit(lambda: services.bump_entitlements_version(old_email))
+
+
+@receiver(post_save, sender=Students)
+@receiver(post_delete, sender=Students)
+def students_changed(sender, instance, **kwargs):
+    email = instance.email
+    transaction.on_commit(lambda: services.bump_entitlements_version(email))
@@ -1,3 +1,112 @@
+import time
+from unittest import mock
+from django.core.cache import cache
 from django.test import TestCase
+from emails.models import Email
+from . import services
+from .models import Answer, Course, Lesson, PublishStatus, Question, Quiz, Students
 
-# Create your tests here.
+
+def expire_entitlements():
+    # signing reads the clock, move it past ENTITLEMENTS_MAX_AGE
+    now = time.time() + services.ENTITLEMENTS_MAX_AGE + 1
+    return mock.patch('django.core.signing.time.time', return_value=now)
+
+
+class SessionEntitlementsTestCase(TestCase):
+    """
+    Students changes whose version bump this process never sees
+    (on_commit hooks don't run in a TestCase, like a bump made in
+    another worker's locmem cache)
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.course_obj = Course.objects.create(title='Course', status=PublishStatus.PUBLISHED)
+        self.lesson_obj = Lesson.objects.create(course=self.course_obj, title='Lesson')
+        self.email_obj = Email.objects.create(email='student@example.com')
+        self.session = {}
+
+    def get_access(self):
+        email_id = self.email_obj.id
+        return services.get_lesson_access(
+            course_id=self.course_obj.public_id,
+            lesson_id=self.lesson_obj.public_id,
+            email_id=email_id,
+            entitlements=services.get_session_entitlements(self.session, email_id)
+        )
+
+    def test_revoke(self):
+        student_obj = Students.objects.create(course=self.course_obj, email=self.email_obj.email)
+        services.store_session_entitlements(self.session, self.email_obj)
+        student_obj.delete()
+        # stale within ENTITLEMENTS_MAX_AGE
+        self.assertTrue(self.get_access().is_enrolled)
+        with expire_entitlements():
+            self.assertFalse(self.get_access().is_enrolled)
+            # re-read, trusted again
+            self.assertEqual(services.get_session_entitlements(self.session, self.email_obj.id), frozenset())
+
+    def test_grant(self):
+        services.store_session_entitlements(self.session, self.email_obj)
+        Students.objects.create(course=self.course_obj, email=self.email_obj.email)
+        self.assertFalse(self.get_access().is_enrolled)
+        with expire_entitlements():
+            self.assertTrue(self.get_access().is_enrolled)
+            self.assertEqual(
+                services.get_session_entitlements(self.session, self.email_obj.id),
+                frozenset([self.course_obj.id])
+            )
+
+    def test_version_bump(self):
+        services.store_session_entitlements(self.session, self.email_obj)
+        Students.objects.create(course=self.course_obj, email=self.email_obj.email)
+        services.bump_entitlements_version(self.email_obj.email)
+        self.assertTrue(self.get_access().is_enrolled)
+
+
+class QuizGradingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        course_obj = Course.objects.create(title='Course', status=PublishStatus.PUBLISHED)
+        lesson_obj = Lesson.objects.create(course=course_obj, title='Lesson', has_quiz=True)
+        self.quiz = Quiz.objects.create(lesson=lesson_obj, title='Quiz')
+        self.first = Question.objects.create(quiz=self.quiz, text='First', order=1)
+        self.first_right = Answer.objects.create(question=self.first, text='Right', is_correct=True)
+        self.first_wrong = Answer.objects.create(question=self.first, text='Wrong')
+        self.second = Question.objects.create(quiz=self.quiz, text='Second', order=2)
+        self.second_right = Answer.objects.create(question=self.second, text='Right', is_correct=True)
+        # no answers yet, still part of the total
+        Question.objects.create(quiz=self.quiz, text='Third', order=3)
+
+    def grade(self, *picks):
+        # (question, answer) pairs, as the quiz form posts them
+        return services.grade_quiz(self.quiz, {
+            question.public_id: answer.public_id for question, answer in picks
+        })
+
+    def test_answer_from_another_question_is_rejected(self):
+        result = self.grade((self.first, self.second_right), (self.second, self.second_right))
+        self.assertEqual(result.score, 1)
+
+    def test_question_without_answers_counts(self):
+        result = self.grade((self.first, self.first_right), (self.second, self.second_right))
+        self.assertEqual(result.score, 2)
+        self.assertEqual(result.total_questions, 3)
+        self.assertAlmostEqual(result.percentage, 200 / 3)
+
+    def test_warm_cache_makes_no_queries(self):
+        self.grade((self.first, self.first_right))
+        with self.assertNumQueries(0):
+            result = self.grade((self.first, self.first_right))
+        self.assertEqual(result.score, 1)
+
+    def test_answer_save_regrades(self):
+        self.assertEqual(self.grade((self.first, self.first_wrong)).score, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first_wrong.is_correct = True
+            self.first_wrong.save()
+            self.first_right.is_correct = False
+            self.first_right.save()
+        self.assertEqual(self.grade((self.first, self.first_wrong)).score, 1)
+        self.assertEqual(self.grade((self.first, self.first_right)).score, 0)
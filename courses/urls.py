@@ -4,8 +4,10 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
+    path('hx/feed/', views.course_feed_hx_view),
     path('<slug:course_id>/lessons/<slug:lesson_id>/quiz/', views.quiz_view, name='quiz'),
     path('<slug:course_id>/lessons/<slug:lesson_id>/', views.lesson_detail_view),
+    path('<slug:course_id>/hx/lessons/', views.lesson_feed_hx_view),
     path('<slug:course_id>/', views.course_detail_view),
     path('', views.course_list_view),
 ]
\ No newline at end of file
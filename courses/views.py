@@ -1,67 +1,200 @@
+import hashlib
+from urllib.parse import urlencode
+from django.conf import settings
 from django.shortcuts import render, redirect
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django.http import Http404, JsonResponse, HttpResponseBadRequest, HttpResponseNotFound, HttpResponseForbidden
 from . import services
 import helpers
-from emails.models import Email
-from courses.models import Lesson, Students, Quiz, Question, Answer
+from courses.models import Lesson, Quiz, Question, Answer
 # Create your views here.
 
 
-def course_list_view(request):
-    queryset = services.get_publish_courses()
-    context = {
-        'object_list': queryset
-    }
-    template_name = 'courses/list.html'
+def get_feed_url(path, cursor):
+    if cursor is None:
+        return None
+    return f"{path}?{urlencode({'cursor': cursor})}"
+
+
+def get_validators(request, email_id, last_modified=None, *parts):
+    """
+    ETag over the page's own state (parts) plus what differs per viewer:
+    htmx partial vs full page, the csrf cookie the rendered
+    (masked) csrf_token is bound to, and the session email
+    base.html's navbar shows Login or Logout for
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    raw = ":".join(f"{part}" for part in (
+        bool(request.htmx),
+        bool(email_id),
+        hashlib.md5(csrf_cookie.encode('utf-8')).hexdigest(),
+        last_modified.timestamp() if last_modified else '',
+        *parts
+    ))
+    etag = quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+    return etag, last_modified
+
+
+def set_validators(response, etag, last_modified=None):
+    if response.status_code in (200, 304):
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    # always revalidate, never heuristically fresh from Last-Modified
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('HX-Request', 'Cookie'))
+    return response
+
+
+def get_not_modified(request, etag, last_modified=None):
+    """
+    304 response when the client's copy is current, else None
+    (checked before any template rendering)
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        return None
+    return set_validators(response, etag, last_modified)
+
+
+async def course_list_view(request):
+    # base.html's navbar reads request.session.email_id, load it
+    # here since a lazy session load would query inside the event loop
+    email_id = await request.session.aget('email_id')
+    stats = await services.aget_catalog_stats()
+    etag, last_modified = get_validators(request, email_id, stats['last_updated'], stats['total'])
+    not_modified = get_not_modified(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
     if request.htmx:
+        queryset = (await services.aget_catalog_page(page_size=3)).object_list
         template_name = 'courses/snippets/list-display.html'
-        context['queryset'] = queryset[:3]
-    return render(request, template_name, context)
+        context = {
+            'queryset': queryset,
+            'card_kind': 'course',
+            'grid_cache_key': services.get_grid_cache_key(queryset),
+            'next_url': None
+        }
+    else:
+        page = await services.aget_catalog_page()
+        template_name = 'courses/list.html'
+        context = {
+            'object_list': page.object_list,
+            'grid_cache_key': services.get_grid_cache_key(page.object_list),
+            'next_url': get_feed_url('/courses/hx/feed/', page.next_cursor)
+        }
+    return set_validators(render(request, template_name, context), etag, last_modified)
+
 
+async def course_feed_hx_view(request):
+    if not request.htmx:
+        return redirect('/courses/')
+    page = await services.aget_catalog_page(cursor=request.GET.get('cursor'))
+    if page is None:
+        return HttpResponseBadRequest('Invalid cursor')
+    return render(request, 'courses/snippets/feed-page.html', {
+        'queryset': page.object_list,
+        'card_kind': 'course',
+        'next_url': get_feed_url('/courses/hx/feed/', page.next_cursor)
+    })
 
-def course_detail_view(request, course_id=None, *args, **kwargs):
-    course_obj = services.get_course_detail(course_id=course_id)
+
+async def course_detail_view(request, course_id=None, *args, **kwargs):
+    # see course_list_view
+    email_id = await request.session.aget('email_id')
+    course_obj = await services.aget_course_detail(course_id=course_id, with_lesson_stats=True)
     if course_obj is None:
-        return Http404
-    lesson_queryset = course_obj.lesson_set.all()
+        raise Http404
+    last_modified = max(filter(None, [course_obj.updated, course_obj.lessons_updated]))
+    etag, last_modified = get_validators(
+        request,
+        email_id,
+        last_modified,
+        course_obj.id,
+        course_obj.lessons_count
+    )
+    not_modified = get_not_modified(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    page = await services.aget_lesson_page(course_obj)
     context = {
         'object': course_obj,
-        'lesson_queryset': services.get_course_lessons(course_obj)
+        'lesson_queryset': page.object_list,
+        'grid_cache_key': services.get_grid_cache_key(page.object_list),
+        'next_url': get_feed_url(f"{course_obj.path}/hx/lessons/", page.next_cursor)
     }
     # return JsonResponse({'data': course_obj.id, 'lesson_ids': [x.path for x in lesson_queryset]})
-    return render(request, 'courses/detail.html', context)
+    return set_validators(render(request, 'courses/detail.html', context), etag, last_modified)
 
 
-def lesson_detail_view(request, course_id=None, lesson_id=None, *args, **kwargs):
-    lesson_obj = services.get_lesson_detail(course_id=course_id, lesson_id=lesson_id)
-    course_obj = services.get_course_detail(course_id=course_id)
-    if lesson_obj is None:
-        return Http404
-    email_id_exists = request.session.get('email_id')
+async def lesson_feed_hx_view(request, course_id=None, *args, **kwargs):
+    if not request.htmx:
+        return redirect(f'/courses/{course_id}/')
+    course_obj = await services.aget_course_detail(course_id=course_id)
+    if course_obj is None:
+        raise Http404
+    page = await services.aget_lesson_page(course_obj, cursor=request.GET.get('cursor'))
+    if page is None:
+        return HttpResponseBadRequest('Invalid cursor')
+    return render(request, 'courses/snippets/feed-page.html', {
+        'queryset': page.object_list,
+        'card_kind': 'lesson',
+        'next_url': get_feed_url(f"{course_obj.path}/hx/lessons/", page.next_cursor)
+    })
+
+
+async def lesson_detail_view(request, course_id=None, lesson_id=None, *args, **kwargs):
+    email_id_exists = await request.session.aget('email_id')
+    access = await services.aget_lesson_access(
+        course_id=course_id,
+        lesson_id=lesson_id,
+        email_id=email_id_exists,
+        entitlements=await services.aget_session_entitlements(request.session, email_id_exists)
+    )
+    if access is None:
+        raise Http404
+    lesson_obj = access.lesson
+    course_obj = access.course
     if lesson_obj.requires_email and not email_id_exists:
-        request.session['next_url'] = request.path
-        request.session['lesson_obj_id'] = lesson_obj.public_id
-        request.session['course_obj_id'] = course_obj.public_id
+        await request.session.aset('next_url', request.path)
+        await request.session.aset('lesson_obj_id', lesson_obj.public_id)
+        await request.session.aset('course_obj_id', course_obj.public_id)
         return render(request, 'courses/email-required.html')
 
-    email = Email.objects.get(id=email_id_exists)
-    is_whitelisted = Students.objects.filter(
-        course=course_obj,
-        email=email.email
-    ).exists()
-    if not is_whitelisted:
+    quiz = access.quiz
+    last_modified = max(filter(None, [
+        lesson_obj.updated,
+        course_obj.updated,
+        quiz.updated if quiz else None
+    ]))
+    if lesson_obj.requires_email and not access.is_enrolled:
         print('not whitelisted')
+        etag, last_modified = get_validators(
+            request,
+            email_id_exists,
+            last_modified,
+            lesson_obj.id,
+            'not-registered'
+        )
+        not_modified = get_not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
         template = 'courses/not-registered.html'
         context = {
             'object': lesson_obj,
             'message': 'This email is not registered for this course.'
         }
-        return render(request, template, context)
+        return set_validators(render(request, template, context), etag, last_modified)
 
     template_name = 'courses/lesson-coming-soon.html'
     context = {
         'object': lesson_obj
     }
+    video_embed_html = ''
     if not lesson_obj.is_coming_soon and lesson_obj.has_video:
         """
         Lesson is published
@@ -69,6 +202,7 @@ def lesson_detail_view(request, course_id=None, lesson_id=None, *args, **kwargs)
         go forward
         """
         template_name = 'courses/lesson.html'
+        # cached, and a re-signed video url has to change the etag
         video_embed_html = helpers.get_cloudinary_video_object(
             lesson_obj,
             as_html=True,
@@ -76,55 +210,68 @@ def lesson_detail_view(request, course_id=None, lesson_id=None, *args, **kwargs)
             width=750)
         context['video_embed'] = video_embed_html
         # Add quiz context
-        if lesson_obj.has_quiz and hasattr(lesson_obj, 'quiz'):
-            context['quiz'] = lesson_obj.quiz
-        else:
-            context['quiz'] = None
-    return render(request, template_name, context)
+        context['quiz'] = quiz
+    etag, last_modified = get_validators(
+        request,
+        email_id_exists,
+        last_modified,
+        lesson_obj.id,
+        template_name,
+        access.is_enrolled,
+        quiz.id if quiz else '',
+        hashlib.md5(f"{video_embed_html}".encode('utf-8')).hexdigest()
+    )
+    not_modified = get_not_modified(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    return set_validators(render(request, template_name, context), etag, last_modified)
 
 
 def quiz_view(request, course_id=None, lesson_id=None):
-    course_obj = services.get_course_detail(course_id=course_id)
-    lesson_obj = services.get_lesson_detail(course_id=course_id, lesson_id=lesson_id)
-    if lesson_obj is None:
+    email_id_exists = request.session.get('email_id')
+    access = services.get_lesson_access(
+        course_id=course_id,
+        lesson_id=lesson_id,
+        email_id=email_id_exists,
+        entitlements=services.get_session_entitlements(request.session, email_id_exists)
+    )
+    if access is None:
         raise Http404
-    if not lesson_obj.has_quiz or not hasattr(lesson_obj, 'quiz') or not lesson_obj.quiz:
+    lesson_obj = access.lesson
+    course_obj = access.course
+    if access.quiz is None:
         return render(request, 'courses/lesson.html', {
             'object': lesson_obj,
             'error': 'No quiz available for this lesson.'
         })
 
     # Check email access
-    email_id_exists = request.session.get('email_id')
     if lesson_obj.requires_email and not email_id_exists:
         request.session['next_url'] = request.path
         request.session['lesson_obj_id'] = lesson_obj.public_id
-        request.session['course_obj_id'] = lesson_obj.course.public_id
+        request.session['course_obj_id'] = course_obj.public_id
         return render(request, 'courses/email-required.html')
 
-    quiz = lesson_obj.quiz
+    if lesson_obj.requires_email and not access.is_enrolled:
+        return render(request, 'courses/not-registered.html', {
+            'object': lesson_obj,
+            'message': 'This email is not registered for this course.'
+        })
+
+    quiz = access.quiz
     if request.method == 'POST':
-        score = 0
-        total_questions = quiz.questions.count()
-        for question in quiz.questions.all():
-            selected_answer_id = request.POST.get(f'question_{question.public_id}')
-            if selected_answer_id:
-                try:
-                    selected_answer = Answer.objects.get(public_id=selected_answer_id)
-                    if selected_answer.is_correct:
-                        score += 1
-                except Answer.DoesNotExist:
-                    pass
-        percentage = (score / total_questions) * 100 if total_questions > 0 else 0
+        submitted = services.get_quiz_submission(request.POST)
+        result = services.grade_quiz(quiz, submitted)
         return render(request, 'courses/quiz_result.html', {
             'course_obj': course_obj,
             'object': lesson_obj,
             'quiz': quiz,
-            'score': score,
-            'total_questions': total_questions,
-            'percentage': percentage
+            'score': result.score,
+            'total_questions': result.total_questions,
+            'percentage': result.percentage
         })
     return render(request, 'courses/quiz.html', {
         'object': lesson_obj,
-        'quiz': quiz
+        'quiz': quiz,
+        'quiz_payload': quiz.get_payload()
     })
\ No newline at end of file
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Email, EmailVerificationEvent
+from .models import Email, EmailVerificationEvent, OutboundEmail
 
 admin.site.register(Email)
-admin.site.register(EmailVerificationEvent)
\ No newline at end of file
+admin.site.register(EmailVerificationEvent)
+admin.site.register(OutboundEmail)
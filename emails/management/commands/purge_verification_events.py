@@ -0,0 +1,69 @@
+import json
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from emails.models import EmailVerificationEvent
+
+
+class Command(BaseCommand):
+    help = 'Delete, or archive then delete, expired and old email verification events in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=getattr(settings, 'EMAILS_VERIFICATION_RETENTION_DAYS', 30),
+                            help='events older than this many days')
+        parser.add_argument('--expired-days', type=int,
+                            default=getattr(settings, 'EMAILS_VERIFICATION_EXPIRED_RETENTION_DAYS', 1),
+                            help='expired events older than this many days')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='seconds between batches, lets other writers in')
+        parser.add_argument('--archive', help='append the purged rows to this .jsonl file')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        now = timezone.now()
+        qs = EmailVerificationEvent.objects.filter(
+            Q(timestamp__lt=now - timedelta(days=options['days'])) |
+            Q(expired=True, timestamp__lt=now - timedelta(days=options['expired_days']))
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{qs.count()} events would be purged')
+            return
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else None
+        purged = 0
+        last_id = 0
+        try:
+            while True:
+                # short transactions on pk ranges, never one long delete
+                with transaction.atomic():
+                    batch = qs.filter(id__gt=last_id).order_by('id')
+                    if archive is not None:
+                        rows = list(batch.values()[:batch_size])
+                        ids = [row['id'] for row in rows]
+                    else:
+                        ids = list(batch.values_list('id', flat=True)[:batch_size])
+                    if not ids:
+                        break
+                    if archive is not None:
+                        for row in rows:
+                            archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                        archive.flush()
+                    EmailVerificationEvent.objects.filter(id__in=ids).delete()
+                purged += len(ids)
+                last_id = ids[-1]
+                self.stdout.write(f'{purged} purged')
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        finally:
+            if archive is not None:
+                archive.close()
+        self.stdout.write(self.style.SUCCESS(f'Verification events purged: {purged}'))
@@ -0,0 +1,56 @@
+import time
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand, CommandError
+from emails import services
+
+
+class Command(BaseCommand):
+    help = 'Send queued outbound emails over one reused mail connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=5,
+                            help='seconds to sleep when the queue is empty')
+        parser.add_argument('--max-attempts', type=int, default=services.QUEUE_MAX_ATTEMPTS)
+        parser.add_argument('--once', action='store_true',
+                            help='drain what is due, then exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        connection = None
+        totals = [0, 0, 0]
+        try:
+            while True:
+                batch = services.claim_outbound_emails(batch_size=batch_size)
+                if not batch:
+                    if connection is not None:
+                        # don't hold the smtp session open while idle
+                        connection.close()
+                        connection = None
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                if connection is None:
+                    connection = get_connection(backend=settings.EMAIL_BACKEND, fail_silently=False)
+                    try:
+                        connection.open()
+                    except Exception as e:
+                        # each send retries the open and backs off on failure
+                        self.stderr.write(f'mail connection failed: {e}')
+                counts = services.send_outbound_emails(
+                    batch,
+                    connection,
+                    max_attempts=options['max_attempts']
+                )
+                totals = [total + count for total, count in zip(totals, counts)]
+                self.stdout.write('sent {}, retrying {}, failed {}'.format(*counts))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if connection is not None:
+                connection.close()
+        self.stdout.write(self.style.SUCCESS('Mail worker stopped: sent {}, retrying {}, failed {}'.format(*totals)))
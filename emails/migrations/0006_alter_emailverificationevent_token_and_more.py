@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:39
+
+import uuid
+from django.db import migrations, models
+
+
+def regenerate_duplicate_tokens(apps, schema_editor):
+    # 0004 added token with a callable default, evaluated once,
+    # so every row that existed then shares one value
+    EmailVerificationEvent = apps.get_model('emails', 'EmailVerificationEvent')
+    db_alias = schema_editor.connection.alias
+    seen = set()
+    for row in EmailVerificationEvent.objects.using(db_alias).order_by('id').only('id', 'token'):
+        if row.token in seen:
+            row.token = uuid.uuid1()
+            row.save(update_fields=['token'])
+        seen.add(row.token)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0005_outboundemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(regenerate_duplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='emailverificationevent',
+            name='token',
+            field=models.UUIDField(default=uuid.uuid1, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='emailverificationevent',
+            index=models.Index(fields=['email', 'timestamp'], name='emails_emai_email_6ecb45_idx'),
+        ),
+    ]
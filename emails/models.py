@@ -1,6 +1,7 @@
 import uuid
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -14,7 +15,7 @@ class Email(models.Model):
 class EmailVerificationEvent(models.Model):
     parent = models.ForeignKey(Email, on_delete=models.SET_NULL, null=True)
     email = models.EmailField()
-    token = models.UUIDField(default=uuid.uuid1)
+    token = models.UUIDField(default=uuid.uuid1, unique=True)
     attempts = models.IntegerField(default=0)
     last_attempt_at = models.DateTimeField(
         auto_now=False,
@@ -31,5 +32,52 @@ class EmailVerificationEvent(models.Model):
     )
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # recent events of an email
+            models.Index(fields=['email', 'timestamp']),
+        ]
+
     def get_link(self):
         return f'{settings.BASE_URL}/verify/{self.token}/'
+
+
+class OutboundStatus(models.TextChoices):
+    QUEUED = 'queued', 'Queued'
+    SENT = 'sent', 'Sent'
+    FAILED = 'failed', 'Failed'
+
+
+class OutboundEmail(models.Model):
+    """
+    Queued message, sent by manage.py run_mail_worker
+    """
+    event = models.ForeignKey(EmailVerificationEvent, on_delete=models.SET_NULL, null=True, blank=True)
+    to_email = models.EmailField()
+    from_email = models.EmailField(blank=True, null=True)
+    subject = models.CharField(max_length=255)
+    text_body = models.TextField()
+    html_body = models.TextField(blank=True, null=True)
+    status = models.CharField(
+        max_length=10,
+        choices=OutboundStatus.choices,
+        default=OutboundStatus.QUEUED
+    )
+    attempts = models.IntegerField(default=0)
+    # due time while queued, pushed forward as a lease when
+    # a worker claims the row and as backoff after a failure
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.UUIDField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the worker's due-queue scan
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} - {self.subject}"
@@ -0,0 +1,39 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+TRUST_X_FORWARDED_FOR = getattr(settings, 'EMAILS_TRUST_X_FORWARDED_FOR', False)
+
+
+def get_client_ip(request):
+    # only trust the proxy header when we sit behind one that sets it
+    if TRUST_X_FORWARDED_FOR:
+        forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded_for:
+            return forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def get_bucket_key(scope, value):
+    value_hash = hashlib.md5(f"{value}".strip().lower().encode('utf-8')).hexdigest()
+    return f"emails:ratelimit:{scope}:{value_hash}"
+
+
+def take_token(key, capacity, period):
+    """
+    Token bucket kept in the cache: capacity tokens,
+    refilled evenly over period seconds. True when a token
+    was taken. Read-modify-write, so concurrent requests can
+    slip a token or two through, that's fine for a limiter
+    """
+    if capacity < 1:
+        return True
+    now = time.time()
+    tokens, last = cache.get(key) or (capacity, now)
+    tokens = min(capacity, tokens + (now - last) * capacity / period)
+    if tokens < 1:
+        cache.set(key, (tokens, now), period)
+        return False
+    cache.set(key, (tokens - 1, now), period)
+    return True
@@ -1,15 +1,58 @@
-from .models import Email, EmailVerificationEvent
+import uuid
+from datetime import timedelta
+from . import ratelimit
+from .models import Email, EmailVerificationEvent, OutboundEmail, OutboundStatus
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, send_mail
+from django.db import connections, router, transaction
+from django.db.models import Case, DateTimeField, F, Q, Value, When
+from django.db.models.sql import UpdateQuery
 from django.utils import timezone
+from courses import cache as course_cache
 
 
 EMAIL_HOST_USER = settings.EMAIL_HOST_USER
+QUEUE_MAX_ATTEMPTS = getattr(settings, 'EMAILS_QUEUE_MAX_ATTEMPTS', 5)
+QUEUE_RETRY_BACKOFF = getattr(settings, 'EMAILS_QUEUE_RETRY_BACKOFF', 30)
+QUEUE_RETRY_BACKOFF_MAX = getattr(settings, 'EMAILS_QUEUE_RETRY_BACKOFF_MAX', 60 * 60)
+QUEUE_LEASE = getattr(settings, 'EMAILS_QUEUE_LEASE', 5 * 60)
+INACTIVE_EMAILS_VERSION_KEY = 'emails:inactive:version'
+INACTIVE_EMAILS_CACHE_TIMEOUT = getattr(settings, 'EMAILS_INACTIVE_CACHE_TIMEOUT', 60 * 60)
+VERIFICATION_REUSE_WINDOW = getattr(settings, 'EMAILS_VERIFICATION_REUSE_WINDOW', 5 * 60)
+RATE_LIMIT_EMAIL_CAPACITY = getattr(settings, 'EMAILS_RATE_LIMIT_EMAIL_CAPACITY', 3)
+RATE_LIMIT_EMAIL_PERIOD = getattr(settings, 'EMAILS_RATE_LIMIT_EMAIL_PERIOD', 15 * 60)
+RATE_LIMIT_IP_CAPACITY = getattr(settings, 'EMAILS_RATE_LIMIT_IP_CAPACITY', 20)
+RATE_LIMIT_IP_PERIOD = getattr(settings, 'EMAILS_RATE_LIMIT_IP_PERIOD', 15 * 60)
+
+
+def get_inactive_emails_version():
+    return course_cache.get_version(INACTIVE_EMAILS_VERSION_KEY)
+
+
+def bump_inactive_emails_version():
+    course_cache.bump_version(INACTIVE_EMAILS_VERSION_KEY)
+
+
+def is_email_inactive(email):
+    """
+    Cached per address under the inactive version, one small
+    entry per lookup whatever the size of the table,
+    emails/signals.py bumps the version when an Email changes
+    """
+    cache_key = course_cache.make_key(
+        'emails:inactive', get_inactive_emails_version(), course_cache.hash_part(email)
+    )
+    inactive = cache.get(cache_key)
+    if inactive is None:
+        inactive = Email.objects.filter(email=email, active=False).exists()
+        cache.set(cache_key, inactive, INACTIVE_EMAILS_CACHE_TIMEOUT)
+    return inactive
 
 
 def verify_email(email):
-    qs = Email.objects.filter(email=email, active=False)
-    return qs.exists()
+    # True for an inactive email
+    return is_email_inactive(email)
 
 
 def get_verification_email_msg(verification_instance, as_html=False):
@@ -21,67 +64,250 @@ def get_verification_email_msg(verification_instance, as_html=False):
     return f'Verify your email with the following:\n{verify_link}'
 
 
-def start_verification_event(email):
+def get_reusable_verification_event(email, max_attempts=5):
+    # uses the (email, timestamp) index
+    if VERIFICATION_REUSE_WINDOW <= 0:
+        return None
+    return EmailVerificationEvent.objects.filter(
+        email=email,
+        expired=False,
+        attempts__lt=max_attempts,
+        timestamp__gte=timezone.now() - timedelta(seconds=VERIFICATION_REUSE_WINDOW)
+    ).order_by('-timestamp').first()
+
+
+def start_verification_event(email, client_ip=None):
+    """
+    Creates the event and queues its email,
+    sent later by manage.py run_mail_worker.
+    (event, None) when a recent unexpired event is reused,
+    (None, None) when the ip or email is rate limited
+    """
+    if client_ip and not ratelimit.take_token(
+        ratelimit.get_bucket_key('ip', client_ip),
+        RATE_LIMIT_IP_CAPACITY,
+        RATE_LIMIT_IP_PERIOD
+    ):
+        return None, None
+    obj = get_reusable_verification_event(email)
+    if obj is not None:
+        return obj, None
+    if not ratelimit.take_token(
+        ratelimit.get_bucket_key('email', email),
+        RATE_LIMIT_EMAIL_CAPACITY,
+        RATE_LIMIT_EMAIL_PERIOD
+    ):
+        return None, None
     email_obj, created = Email.objects.get_or_create(email=email)
     obj = EmailVerificationEvent.objects.create(
         parent=email_obj,
         email=email
     )
-    sent = send_verification_event(obj.id)
-    return obj, sent
+    queued = queue_verification_event(obj)
+    return obj, queued
+
+
+def get_verification_event_kwargs(verify_obj):
+    return {
+        'subject': 'Verify your email',
+        'text_body': get_verification_email_msg(verify_obj, as_html=False),
+        'html_body': get_verification_email_msg(verify_obj, as_html=True),
+        'from_email': EMAIL_HOST_USER,
+        'to_email': verify_obj.email,
+    }
+
+
+def queue_verification_event(verify_obj):
+    return OutboundEmail.objects.create(
+        event=verify_obj,
+        **get_verification_event_kwargs(verify_obj)
+    )
 
 
 def send_verification_event(verify_obj_id):
+    # synchronous send, bypasses the queue
     verify_obj = EmailVerificationEvent.objects.get(id=verify_obj_id)
-    email = verify_obj.email
-    subject = 'Verify your email'
-    text_msg = get_verification_email_msg(verify_obj, as_html=False)
-    html_msg = get_verification_email_msg(verify_obj, as_html=True)
-    from_user_email_addr = EMAIL_HOST_USER
-    to_user_email = email
+    kwargs = get_verification_event_kwargs(verify_obj)
     # send verification email
     print('email sent')
     return send_mail(
-        subject,
-        text_msg,
-        from_user_email_addr,
-        [to_user_email],
+        kwargs['subject'],
+        kwargs['text_body'],
+        kwargs['from_email'],
+        [kwargs['to_email']],
         fail_silently=False,
-        html_message=html_msg
+        html_message=kwargs['html_body']
     )
 
 
-def verify_token(token, max_attempts=5):
-    qs = EmailVerificationEvent.objects.filter(token=token)
-    if not qs.exists() and not qs.count() == 1:
-        return False, "Invalid token", None
+def get_outbound_message(outbound_obj, connection=None):
+    message = EmailMultiAlternatives(
+        subject=outbound_obj.subject,
+        body=outbound_obj.text_body,
+        from_email=outbound_obj.from_email or None,
+        to=[outbound_obj.to_email],
+        connection=connection
+    )
+    if outbound_obj.html_body:
+        message.attach_alternative(outbound_obj.html_body, 'text/html')
+    return message
+
+
+def get_retry_delay(attempts):
+    # exponential backoff, attempts starts at 1
+    delay = QUEUE_RETRY_BACKOFF * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, QUEUE_RETRY_BACKOFF_MAX))
+
+
+def claim_outbound_emails(batch_size=50, lease=None):
     """
-    Has token
+    Due queued emails, leased to this worker: a row another
+    worker claimed first is skipped, a row whose worker died
+    becomes due again when its lease runs out
     """
-    has_email_expired = qs.filter(expired=True)
-    if has_email_expired.exists():
-        """token expired"""
-        return False, "Token expired, try again.", None
+    now = timezone.now()
+    lease = QUEUE_LEASE if lease is None else lease
+    ids = list(
+        OutboundEmail.objects.filter(
+            status=OutboundStatus.QUEUED,
+            next_attempt_at__lte=now
+        ).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    claim = uuid.uuid4()
+    OutboundEmail.objects.filter(
+        id__in=ids,
+        status=OutboundStatus.QUEUED,
+        next_attempt_at__lte=now
+    ).update(
+        claim=claim,
+        attempts=F('attempts') + 1,
+        next_attempt_at=now + timedelta(seconds=lease),
+        updated=now
+    )
+    return list(OutboundEmail.objects.filter(claim=claim).order_by('id'))
+
+
+def send_outbound_emails(outbound_objs, connection, max_attempts=None):
     """
-    Has token, not expired
+    Sends claimed emails over one open connection,
+    returns (sent, retried, failed) counts
     """
-    max_attempts_reached = qs.filter(attempts__gte=max_attempts)
-    if max_attempts_reached.exists():
-        """update max attempts +1"""
-        #max_attempts_reached.update()
-        return False, "Token used too many times", None
-    """Token valid"""
-    """Update attempts, expire token if attempts > max"""
-    obj = qs.first()
-    obj.attempts += 1
-    obj.last_attempt_at = timezone.now()
-    if obj.attempts > max_attempts:
-        """invalidation process"""
-        obj.expired = True
-        obj.expired_at = timezone.now()
-    obj.save()
-    email_obj = obj.parent
-    return True, "Welcome", email_obj
+    max_attempts = max_attempts or QUEUE_MAX_ATTEMPTS
+    sent = retried = failed = 0
+    for obj in outbound_objs:
+        message = get_outbound_message(obj, connection=connection)
+        try:
+            connection.send_messages([message])
+        except Exception as e:
+            now = timezone.now()
+            obj.last_error = f"{e.__class__.__name__}: {e}"
+            obj.claim = None
+            if obj.attempts >= max_attempts:
+                obj.status = OutboundStatus.FAILED
+                failed += 1
+            else:
+                obj.next_attempt_at = now + get_retry_delay(obj.attempts)
+                retried += 1
+            obj.save(update_fields=['status', 'next_attempt_at', 'claim', 'last_error', 'updated'])
+            # the server may have dropped us, reconnect for the rest
+            connection.close()
+            try:
+                connection.open()
+            except Exception:
+                # send_messages retries the open, and fails, per message
+                pass
+            continue
+        obj.status = OutboundStatus.SENT
+        obj.sent_at = timezone.now()
+        obj.claim = None
+        obj.last_error = None
+        obj.save(update_fields=['status', 'sent_at', 'claim', 'last_error', 'updated'])
+        sent += 1
+    return sent, retried, failed
+
+
+def can_update_returning(connection):
+    # sqlite >= 3.35 and postgres take UPDATE ... RETURNING,
+    # can_return_columns_from_insert tracks the same sqlite versions
+    return (
+        connection.vendor in ('postgresql', 'sqlite')
+        and connection.features.can_return_columns_from_insert
+    )
 
 
+def update_returning(qs, values, returning, using):
+    """
+    qs.update(**values) on the using db returning the updated rows'
+    columns as tuples, built from the orm's own UPDATE so params and
+    quoting stay the db's. The only code here on private orm api
+    (UpdateQuery, the update compiler), emails.tests covers it
+    """
+    query = qs.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    connection = connections[using]
+    compiler = query.get_compiler(using)
+    # what execute_sql runs first, rewrites filters on related
+    # tables to a pk__in subquery the UPDATE can take
+    compiler.pre_sql_setup()
+    sql, params = compiler.as_sql()
+    opts = qs.model._meta
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(opts.get_field(name).column) for name in returning)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} RETURNING {columns}", params)
+        return cursor.fetchall()
+
 
+def verify_token(token, max_attempts=5):
+    """
+    One conditional UPDATE counts the attempt, and expires the
+    token on its last one, only while it's unexpired and under
+    max_attempts, so concurrent clicks can't lose an increment.
+    The failure message needs a read, the success path doesn't
+    """
+    now = timezone.now()
+    is_last_attempt = Q(attempts__gte=max_attempts - 1)
+    # a write, ask the router so it pins the request to the primary,
+    # the reads below then see this update
+    db = router.db_for_write(EmailVerificationEvent)
+    qs = EmailVerificationEvent.objects.using(db).filter(
+        token=token,
+        expired=False,
+        attempts__lt=max_attempts
+    )
+    # expired before attempts, mysql reads already assigned columns
+    values = {
+        'expired': Case(When(is_last_attempt, then=Value(True)), default=Value(False)),
+        'expired_at': Case(
+            When(is_last_attempt, then=Value(now)),
+            default=Value(None),
+            output_field=DateTimeField()
+        ),
+        'last_attempt_at': now,
+        'attempts': F('attempts') + 1,
+    }
+    if can_update_returning(connections[db]):
+        rows = update_returning(qs, values, ['parent', 'email'], db)
+    else:
+        rows = []
+        with transaction.atomic(using=db):
+            if qs.update(**values):
+                # parent and email never change, safe to read after
+                rows = list(EmailVerificationEvent.objects.using(db).filter(
+                    token=token,
+                    last_attempt_at=now
+                ).values_list('parent_id', 'email'))
+    if rows and rows[0][0] is not None:
+        parent_id, email = rows[0]
+        return True, "Welcome", Email(id=parent_id, email=email)
+    """
+    Not updated, find out why
+    """
+    obj = EmailVerificationEvent.objects.using(db).filter(token=token).values('expired', 'attempts').first()
+    if obj is None or rows:
+        return False, "Invalid token", None
+    if obj['attempts'] >= max_attempts:
+        return False, "Token used too many times", None
+    return False, "Token expired, try again.", None
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Email
+from . import services
+
+
+@receiver(post_save, sender=Email)
+@receiver(post_delete, sender=Email)
+def email_changed(sender, instance, created=False, **kwargs):
+    # a new active email doesn't change any cached lookup
+    if created and instance.active:
+        return
+    transaction.on_commit(services.bump_inactive_emails_version)
@@ -1,3 +1,122 @@
+import uuid
+from unittest import mock
+from django.core.cache import cache
 from django.test import TestCase
+from cfehome import db as cfehome_db
+from . import services
+from .models import Email, EmailVerificationEvent
 
-# Create your tests here.
+
+class VerifyTokenTestCase(TestCase):
+    max_attempts = 5
+
+    def setUp(self):
+        self.email_obj = Email.objects.create(email='student@example.com')
+
+    def create_event(self, **kwargs):
+        return EmailVerificationEvent.objects.create(
+            parent=self.email_obj,
+            email=self.email_obj.email,
+            **kwargs
+        )
+
+    def verify(self, event_obj):
+        return services.verify_token(event_obj.token, max_attempts=self.max_attempts)
+
+    def test_success(self):
+        event_obj = self.create_event()
+        with self.assertNumQueries(1):
+            ok, msg, email_obj = self.verify(event_obj)
+        self.assertTrue(ok)
+        self.assertEqual(msg, "Welcome")
+        self.assertEqual(email_obj.id, self.email_obj.id)
+        self.assertEqual(email_obj.email, self.email_obj.email)
+        event_obj.refresh_from_db()
+        self.assertEqual(event_obj.attempts, 1)
+        self.assertFalse(event_obj.expired)
+        self.assertIsNone(event_obj.expired_at)
+        self.assertIsNotNone(event_obj.last_attempt_at)
+
+    def test_last_attempt_expires_token(self):
+        event_obj = self.create_event(attempts=self.max_attempts - 1)
+        ok, msg, email_obj = self.verify(event_obj)
+        self.assertTrue(ok)
+        self.assertEqual(email_obj.id, self.email_obj.id)
+        event_obj.refresh_from_db()
+        self.assertEqual(event_obj.attempts, self.max_attempts)
+        self.assertTrue(event_obj.expired)
+        self.assertEqual(event_obj.expired_at, event_obj.last_attempt_at)
+
+    def test_over_limit(self):
+        event_obj = self.create_event()
+        for _ in range(self.max_attempts):
+            ok, msg, email_obj = self.verify(event_obj)
+            self.assertTrue(ok)
+        ok, msg, email_obj = self.verify(event_obj)
+        self.assertFalse(ok)
+        self.assertEqual(msg, "Token used too many times")
+        self.assertIsNone(email_obj)
+        event_obj.refresh_from_db()
+        self.assertEqual(event_obj.attempts, self.max_attempts)
+
+    def test_expired(self):
+        event_obj = self.create_event(expired=True)
+        ok, msg, email_obj = self.verify(event_obj)
+        self.assertFalse(ok)
+        self.assertEqual(msg, "Token expired, try again.")
+        event_obj.refresh_from_db()
+        self.assertEqual(event_obj.attempts, 0)
+
+    def test_unknown_token(self):
+        self.create_event()
+        ok, msg, email_obj = services.verify_token(uuid.uuid4(), max_attempts=self.max_attempts)
+        self.assertFalse(ok)
+        self.assertEqual(msg, "Invalid token")
+        self.assertIsNone(email_obj)
+
+    @mock.patch('emails.services.can_update_returning', return_value=False)
+    def test_fallback_without_returning(self, can_update_returning):
+        event_obj = self.create_event(attempts=self.max_attempts - 2)
+        ok, msg, email_obj = self.verify(event_obj)
+        self.assertTrue(ok)
+        self.assertEqual(email_obj.id, self.email_obj.id)
+        ok, msg, email_obj = self.verify(event_obj)
+        self.assertTrue(ok)
+        event_obj.refresh_from_db()
+        self.assertTrue(event_obj.expired)
+        self.assertEqual(event_obj.attempts, self.max_attempts)
+        ok, msg, email_obj = self.verify(event_obj)
+        self.assertFalse(ok)
+        self.assertEqual(msg, "Token used too many times")
+        self.assertTrue(can_update_returning.called)
+
+    def test_pins_primary(self):
+        # the token check is a write, later reads in the request stay on the primary
+        event_obj = self.create_event()
+        token = cfehome_db.primary_pinned.set(False)
+        try:
+            self.verify(event_obj)
+            self.assertTrue(cfehome_db.is_primary_pinned())
+        finally:
+            cfehome_db.primary_pinned.reset(token)
+
+
+class InactiveEmailTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_inactive_lookup_is_cached(self):
+        Email.objects.create(email='gone@example.com', active=False)
+        self.assertTrue(services.verify_email('gone@example.com'))
+        self.assertFalse(services.verify_email('student@example.com'))
+        with self.assertNumQueries(0):
+            self.assertTrue(services.verify_email('gone@example.com'))
+            self.assertFalse(services.verify_email('student@example.com'))
+
+    def test_deactivating_bumps_the_version(self):
+        email_obj = Email.objects.create(email='student@example.com')
+        self.assertFalse(services.verify_email(email_obj.email))
+        with self.captureOnCommitCallbacks(execute=True):
+            email_obj.active = False
+            email_obj.save()
+        self.assertTrue(services.verify_email(email_obj.email))
@@ -1,9 +1,11 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
 from django.http import HttpResponse
 from . import services
 from django.conf import settings
 from django.contrib import messages
 from .forms import EmailForm
+from .ratelimit import get_client_ip
 from django_htmx.http import HttpResponseClientRedirect
 from courses.models import Course, Students
 from courses import services as course_services
@@ -20,6 +22,7 @@ def logout_btn_hx_view(request):
             del request.session['email_id']
         except:
             pass
+        course_services.clear_session_entitlements(request.session)
         email_id_in_session = request.session.get('email_id')
         if not email_id_in_session:
             return HttpResponseClientRedirect('/')
@@ -27,10 +30,10 @@ def logout_btn_hx_view(request):
     return render(request, 'emails/hx/logout-btn.html')
 
 
-def email_token_login_view(request):
+async def email_token_login_view(request):
     if not request.htmx:
         return redirect('/')
-    email_id_in_session = request.session.get('email_id')
+    email_id_in_session = await request.session.aget('email_id')
     template = 'emails/hx/form.html'
     form = EmailForm(request.POST or None)
     context = {
@@ -38,27 +41,36 @@ def email_token_login_view(request):
         'message': '',
         'show_form': not email_id_in_session,
     }
-    if form.is_valid():
+    # clean_email may look the address up in the db
+    if await sync_to_async(form.is_valid)():
         email_val = form.cleaned_data.get('email')
-        course_id = request.session.get('course_obj_id')
-        course_obj = course_services.get_course_detail(course_id=course_id)
-        is_whitelisted = Students.objects.filter(
+        course_id = await request.session.aget('course_obj_id')
+        course_obj = await course_services.aget_course_detail(course_id=course_id)
+        is_whitelisted = await Students.objects.filter(
             course=course_obj,
             email=email_val
-        ).exists()
+        ).aexists()
         if not is_whitelisted:
             print('not whitelisted')
             context['not_allowed'] = True
             context['message'] = 'This email is not allowed.'
             return render(request, template, context)
         print(email_val)
-        obj = services.start_verification_event(email_val)
+        # only enqueues, run_mail_worker does the smtp work
+        obj, queued = await sync_to_async(services.start_verification_event)(
+            email_val,
+            client_ip=get_client_ip(request)
+        )
         print(obj)
+        if obj is None:
+            context['not_allowed'] = True
+            context['message'] = 'Too many login requests, try again in a few minutes.'
+            return render(request, template, context)
         context['form'] = EmailForm()
         context['message'] = f'success you have access. message from {EMAIL_ADDRESS}'
     else:
         print(form.errors)
-    print('email_id', request.session.get('email'))
+    print('email_id', await request.session.aget('email'))
     print('okkkkk')
     return render(request, template, context)
 
@@ -70,10 +82,12 @@ def verify_email_token_view(request, token, *args, **kwargs):
             del request.session['email_id']
         except:
             pass
+        course_services.clear_session_entitlements(request.session)
         messages.error(request, msg)
         return redirect('/login/')
     messages.success(request, msg)
     request.session['email_id'] = f"{email_obj.id}"
+    course_services.store_session_entitlements(request.session, email_obj)
     next_url = request.session.get('next_url') or "/"
     if not next_url.startswith("/"):
         next_url = "/"
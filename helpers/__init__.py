@@ -2,9 +2,13 @@ from ._cloudinary import (
     cloudinary_init,
     get_cloudinary_image_object,
     get_cloudinary_video_object,
+    get_cloudinary_url_cache_info,
+    clear_cloudinary_url_cache,
 )
 
 __all__ = ['cloudinary_init',
            'get_cloudinary_image_object',
-           'get_cloudinary_video_object']
+           'get_cloudinary_video_object',
+           'get_cloudinary_url_cache_info',
+           'clear_cloudinary_url_cache']
 
@@ -1,5 +1,7 @@
 from .config import cloudinary_init
 from .services import get_cloudinary_image_object, get_cloudinary_video_object
+from .urls import get_url_cache_info as get_cloudinary_url_cache_info
+from .urls import clear_url_cache as clear_cloudinary_url_cache
 
 
 cloudinary_init()
@@ -7,5 +9,7 @@ cloudinary_init()
 __all__ = [
     'cloudinary_init',
     'get_cloudinary_image_object',
-    'get_cloudinary_video_object'
+    'get_cloudinary_video_object',
+    'get_cloudinary_url_cache_info',
+    'clear_cloudinary_url_cache',
           ]
@@ -0,0 +1,43 @@
+import functools
+from django.conf import settings
+from django.template.loader import get_template
+from .urls import build_url, freeze_options, get_resource_key, is_expiring, _build_url
+
+CLOUDINARY_EMBED_CACHE_SIZE = getattr(settings, 'CLOUDINARY_EMBED_CACHE_SIZE', 1024)
+EMBED_TEMPLATE_NAME = 'videos/snippets/embed.html'
+
+
+def render_embed_template(video_url, cloud_name):
+    tmpl = get_template(EMBED_TEMPLATE_NAME)
+    return tmpl.render({'video_url': video_url, 'cloud_name': cloud_name})
+
+
+@functools.lru_cache(maxsize=CLOUDINARY_EMBED_CACHE_SIZE)
+def _render_embed(resource_key, options, cloud_name, video_url=None):
+    # expiring urls are part of the key so a refreshed url renders anew
+    if video_url is None:
+        video_url = _build_url(*resource_key, options)
+    return render_embed_template(video_url, cloud_name)
+
+
+def render_video_embed(resource, **options):
+    """
+    videos/snippets/embed.html for a video resource,
+    a cache hit skips both the url builder and the template engine
+    """
+    cloud_name = settings.CLOUDINARY_CLOUD_NAME
+    frozen_options = freeze_options(options)
+    if frozen_options is None:
+        return render_embed_template(build_url(resource, **options), cloud_name)
+    if is_expiring(options):
+        video_url = build_url(resource, **options)
+        return _render_embed(get_resource_key(resource), frozen_options, cloud_name, video_url)
+    return _render_embed(get_resource_key(resource), frozen_options, cloud_name)
+
+
+def get_embed_cache_info():
+    return _render_embed.cache_info()
+
+
+def clear_embed_cache():
+    _render_embed.cache_clear()
@@ -1,12 +1,16 @@
-from django.template.loader import get_template
-from django.conf import settings
+from .embed import render_video_embed
+from .urls import build_url, build_srcset
+
+DEFAULT_SRCSET_WIDTHS = (320, 480, 640, 768, 960, 1200)
 
 
 def get_cloudinary_image_object(instance,
                                 field_name="image",
                                 as_html=False,
                                 format=None,
-                                width=1200
+                                width=1200,
+                                as_srcset=False,
+                                srcset_widths=None,
                                 ):
     if not hasattr(instance, field_name):
         return ""
@@ -18,9 +22,13 @@ def get_cloudinary_image_object(instance,
     }
     if format is not None:
         image_options['format'] = format
+    if as_srcset:
+        widths = srcset_widths or DEFAULT_SRCSET_WIDTHS
+        image_options.pop('width')
+        return build_srcset(image_object, widths, **image_options)
     if as_html:
         return image_object.image(**image_options)
-    url = image_object.build_url(**image_options)
+    url = build_url(image_object, **image_options)
     return url
 
 
@@ -34,7 +42,7 @@ def get_cloudinary_video_object(instance,
                                 as_html=False,
                                 width=None,
                                 height=None,
-                                sign_url=False,
+                                sign_url=None,
                                 fetch_format='auto',
                                 quality='auto',
                                 controls=True,
@@ -45,6 +53,9 @@ def get_cloudinary_video_object(instance,
     video_object = getattr(instance, field_name)
     if not video_object:
         return ''
+    if sign_url is None:
+        # private/authenticated deliveries only resolve with a signature
+        sign_url = video_object.type in ('private', 'authenticated')
     video_options = {
         'sign_url': sign_url,
         'fetch_format': fetch_format,
@@ -58,11 +69,7 @@ def get_cloudinary_video_object(instance,
         video_options['height'] = height
     if height and width:
         video_options['crop'] = 'limit'
-    url = video_object.build_url(**video_options)
     if as_html:
-        template_name = 'videos/snippets/embed.html'
-        tmpl = get_template(template_name)
-        cloud_name = settings.CLOUDINARY_CLOUD_NAME
-        _html = tmpl.render({'video_url': url, 'cloud_name': cloud_name})
-        return _html
+        return render_video_embed(video_object, **video_options)
+    url = build_url(video_object, **video_options)
     return url
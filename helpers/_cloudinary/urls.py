@@ -0,0 +1,162 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from cloudinary import CloudinaryResource
+from django.conf import settings
+
+CLOUDINARY_URL_CACHE_SIZE = getattr(settings, 'CLOUDINARY_URL_CACHE_SIZE', 4096)
+# token based auth key, signed urls only expire when it is set
+CLOUDINARY_AUTH_TOKEN_KEY = getattr(settings, 'CLOUDINARY_AUTH_TOKEN_KEY', None)
+CLOUDINARY_SIGNED_URL_TTL = getattr(settings, 'CLOUDINARY_SIGNED_URL_TTL', 60 * 60)
+CLOUDINARY_SIGNED_URL_REFRESH_MARGIN = getattr(settings, 'CLOUDINARY_SIGNED_URL_REFRESH_MARGIN', 60)
+
+
+# process-local LRU for CloudinaryResource.build_url
+# the url only depends on the resource identity and the options,
+# so equal keys always build the same string
+
+
+@functools.lru_cache(maxsize=CLOUDINARY_URL_CACHE_SIZE)
+def _build_url(public_id, version, resource_type, delivery_type, format, options):
+    resource = CloudinaryResource(
+        public_id=public_id,
+        format=format,
+        version=version,
+        type=delivery_type,
+        resource_type=resource_type
+    )
+    return resource.build_url(**dict(options))
+
+
+def freeze_options(options):
+    # nested transformations (lists, dicts) are not hashable, so not cacheable
+    frozen_options = tuple(sorted(options.items()))
+    try:
+        hash(frozen_options)
+    except TypeError:
+        return None
+    return frozen_options
+
+
+def get_resource_key(resource):
+    return (
+        resource.public_id,
+        resource.version,
+        resource.resource_type,
+        resource.type,
+        resource.format,
+    )
+
+
+class ExpiringURLCache:
+    """
+    Bounded LRU of (url, expires_at), an entry is reused until
+    `margin` seconds before it expires and then rebuilt
+    """
+
+    def __init__(self, maxsize, margin):
+        self.maxsize = maxsize
+        self.margin = margin
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] - self.margin <= now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_signed_urls = ExpiringURLCache(
+    maxsize=CLOUDINARY_URL_CACHE_SIZE,
+    margin=min(CLOUDINARY_SIGNED_URL_REFRESH_MARGIN, CLOUDINARY_SIGNED_URL_TTL // 2)
+)
+
+
+def is_expiring(options):
+    return bool(options.get('sign_url') and CLOUDINARY_AUTH_TOKEN_KEY)
+
+
+def build_expiring_url(resource, ttl=None, **options):
+    """
+    Signed, time-limited delivery url and its unix expiry,
+    the HMAC only runs when the cached url is about to expire
+    """
+    ttl = ttl or CLOUDINARY_SIGNED_URL_TTL
+    now = time.time()
+    frozen_options = freeze_options(options)
+    key = None
+    if frozen_options is not None:
+        key = (get_resource_key(resource), frozen_options, ttl)
+        entry = _signed_urls.get(key, now)
+        if entry is not None:
+            return entry
+    expires_at = int(now) + ttl
+    url = resource.build_url(
+        auth_token={'key': CLOUDINARY_AUTH_TOKEN_KEY, 'expiration': expires_at},
+        **options
+    )
+    entry = (url, expires_at)
+    if key is not None:
+        _signed_urls.set(key, entry)
+    return entry
+
+
+def build_url(resource, **options):
+    if is_expiring(options):
+        return build_expiring_url(resource, **options)[0]
+    frozen_options = freeze_options(options)
+    if frozen_options is None:
+        return resource.build_url(**options)
+    return _build_url(*get_resource_key(resource), frozen_options)
+
+
+def build_srcset(resource, widths, **options):
+    """
+    "url 320w, url 640w, ..." for an <img srcset>, every candidate
+    is delivered with f_auto/q_auto
+    """
+    srcset_options = {'fetch_format': 'auto', 'quality': 'auto', 'crop': 'scale'}
+    srcset_options.update(options)
+    return ", ".join(
+        f"{build_url(resource, width=width, **srcset_options)} {width}w"
+        for width in sorted(set(widths))
+    )
+
+
+def get_url_cache_info():
+    # CacheInfo(hits, misses, maxsize, currsize)
+    return _build_url.cache_info()
+
+
+def get_signed_url_cache_info():
+    return {
+        'hits': _signed_urls.hits,
+        'misses': _signed_urls.misses,
+        'maxsize': _signed_urls.maxsize,
+    }
+
+
+def clear_url_cache():
+    _build_url.cache_clear()
+    _signed_urls.clear()